@@ -0,0 +1,48 @@
+import os, sys, json
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import game
+
+def build_atlas(index_path = game.ATLAS_INDEX, image_name = 'atlas.png', width = 256):
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    animations = {}
+    frames = []
+    for entry in game.ASSETS_MANIFEST:
+        if entry[0] != 'animation':
+            continue
+        path, duration, colorkey = entry[1:]
+        animation_name = path.split('/')[-1]
+        animations[path] = {'durations': duration, 'colorkey': colorkey, 'frames': {}}
+        for n in range(len(duration)):
+            animation_frame_id = animation_name + '_' + str(n)
+            img = pygame.image.load(path + '/' + animation_frame_id + '.png').convert()
+            frames.append((path, animation_frame_id, img))
+
+    # Shelf packing, tallest frames first
+    frames.sort(key = lambda frame: -frame[2].get_height())
+    x, y, shelf = 0, 0, 0
+    placed = []
+    for path, animation_frame_id, img in frames:
+        w, h = img.get_size()
+        if x + w > width:
+            x, y, shelf = 0, y + shelf, 0
+        animations[path]['frames'][animation_frame_id] = [x, y, w, h]
+        placed.append((img, (x, y)))
+        x += w
+        shelf = max(shelf, h)
+
+    atlas = pygame.Surface((width, max(y + shelf, 1))).convert()
+    atlas.fill((255, 0, 255))
+    for img, pos in placed:
+        atlas.blit(img, pos)
+    pygame.image.save(atlas, os.path.join(os.path.dirname(index_path), image_name))
+    with open(index_path, 'w') as file:
+        json.dump({'image': image_name, 'animations': animations}, file, indent = 1)
+    return len(frames)
+
+if __name__ == '__main__':
+    index_path = sys.argv[1] if len(sys.argv) > 1 else game.ATLAS_INDEX
+    print('packed %d frames into %s' % (build_atlas(index_path), index_path))
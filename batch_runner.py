@@ -0,0 +1,115 @@
+import os, time, random, json, argparse
+import concurrent.futures
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import game
+
+# -- Input policies: policy(rng, game, tick) returns the input mask for the tick
+def idle_policy(rng, g, tick):
+    return 0
+
+def random_policy(rng, g, tick):
+    mask = rng.choice((0, game.INPUT_LEFT, game.INPUT_RIGHT))
+    if rng.random() < 0.05:
+        mask |= game.INPUT_JUMP
+    if rng.random() < 0.1:
+        mask |= 1 << game.INPUT_SHOTS
+    return mask
+
+def shoot_policy(rng, g, tick):
+    return (game.INPUT_LEFT if (tick // 120) % 2 else game.INPUT_RIGHT) | (1 << game.INPUT_SHOTS)
+
+POLICIES = {
+    'idle': idle_policy,
+    'random': random_policy,
+    'shoot': shoot_policy,
+}
+
+# -- Worker
+def run_session(seed, policy, ticks, params):
+    # Runs in a worker process, so module-level tuning values can be overridden freely
+    game.GRAVITY = params.get('gravity', game.GRAVITY)
+    game.SPAWN_INTERVAL = tuple(params.get('spawn_interval', game.SPAWN_INTERVAL))
+    for enemy_type in game.enemy_types.values():
+        enemy_type.life = params.get('life', enemy_type.life)
+        enemy_type.angry_life = params.get('angry_life', enemy_type.angry_life)
+
+    g = game.Game(headless = True, seed = seed)
+    g.render_enabled = False
+    rng = random.Random(seed)
+    choose = POLICIES[policy]
+    survival = None
+    start = time.perf_counter()
+    for tick in range(ticks):
+        g.tick(mask = choose(rng, g, tick))
+        if survival is None and g.enemies_manager.collide(g.player.rect):
+            survival = tick
+    elapsed = time.perf_counter() - start
+    return {'seed': seed, 'policy': policy, 'ticks': ticks,
+            'survival_ticks': survival if survival is not None else ticks,
+            'coins': g.coin.collected, 'peak_enemies': g.enemies_manager.stats()['peak'],
+            'tick_ms': elapsed * 1000 / ticks}
+
+# -- Report
+def summarize(results, elapsed, workers):
+    report = {'runs': len(results), 'workers': workers, 'elapsed_s': elapsed, 'runs_per_s': len(results) / elapsed}
+    for metric in ('survival_ticks', 'coins', 'peak_enemies', 'tick_ms'):
+        values = sorted([result[metric] for result in results])
+        report[metric] = {'mean': sum(values) / len(values), 'min': values[0], 'p50': values[len(values) // 2],
+                          'max': values[-1]}
+    return report
+
+def run_batch(runs, policy, ticks, params, workers, seed = 0, out = None):
+    results = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(run_session, seed + i, policy, ticks, params) for i in range(runs)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    return summarize(results, time.perf_counter() - start, workers)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Run seeded headless sessions in parallel')
+    parser.add_argument('--runs', type = int, default = 100)
+    parser.add_argument('--ticks', type = int, default = 3600)
+    parser.add_argument('--policy', choices = list(POLICIES), default = 'random')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--gravity', type = float)
+    parser.add_argument('--life', type = int)
+    parser.add_argument('--angry-life', type = int)
+    parser.add_argument('--spawn-interval', type = int, nargs = 2)
+    parser.add_argument('--results', help = 'stream one JSON line per run to this file')
+    parser.add_argument('--scaling', action = 'store_true', help = 'repeat the batch with 1, 2, 4... workers')
+    args = parser.parse_args()
+
+    params = {}
+    for name in ('gravity', 'life', 'angry_life', 'spawn_interval'):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+
+    if args.scaling:
+        workers = 1
+        base = None
+        while workers <= args.workers:
+            report = run_batch(args.runs, args.policy, args.ticks, params, workers, args.seed)
+            base = base or report['runs_per_s']
+            print('%3d workers %8.2f runs/s  speedup %5.2fx' % (workers, report['runs_per_s'], report['runs_per_s'] / base))
+            workers *= 2
+        return
+
+    out = open(args.results, 'w') if args.results else None
+    report = run_batch(args.runs, args.policy, args.ticks, params, args.workers, args.seed, out)
+    if out is not None:
+        out.close()
+    print(json.dumps(report, indent = 1))
+
+if __name__ == '__main__':
+    main()
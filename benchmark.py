@@ -0,0 +1,799 @@
+import os, sys, time, random, tempfile, collections, types, tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from pygame.locals import *
+import game
+from game import numpy
+
+# -- Helpers
+def make_level(path, size, density = 0.15, seed = 0):
+    rng = random.Random(seed)
+    with open(path + '.dat', 'w') as file:
+        for y in range(size):
+            if y == 0 or y == size - 1:
+                row = '1' * size
+            else:
+                row = '1' + ''.join(rng.choices('01', (1 - density, density), k = size - 2)) + '1'
+            file.write(row + '\n')
+
+def load_level(size):
+    path = os.path.join(tempfile.mkdtemp(), 'level_' + str(size))
+    make_level(path, size)
+    return game.Map(path)
+
+def timed(fn, repeat = 20):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def run_scenario(name, ticks, enemies = 0, script = None):
+    g = game.Game(headless = True)
+    for i in range(enemies):
+        g.enemies_manager.new_enemy()
+    update_times = []
+    render_times = []
+    start = time.perf_counter()
+    for i in range(ticks):
+        g.step(1, script)
+        update_times.append(g.update_time * 1000)
+        render_times.append(g.render_time * 1000)
+    elapsed = time.perf_counter() - start
+    print('%-16s %10.0f %10.3f %10.3f %10.3f %10.3f' % (name, ticks / elapsed,
+        percentile(update_times, 50), percentile(update_times, 99),
+        percentile(render_times, 50), percentile(render_times, 99)))
+
+def shuriken_spam(g, tick):
+    return [game.key_event(KEYDOWN, K_j)]
+
+def wander(g, tick):
+    rng = random.Random(tick)
+    key = (K_a, K_d, K_k, K_j)[rng.randrange(4)]
+    return [game.key_event((KEYDOWN, KEYUP)[rng.randrange(2)], key)]
+
+def random_rects(count, size, seed = 1):
+    rng = random.Random(seed)
+    return [pygame.Rect(rng.randrange(size * 8), rng.randrange(size * 8), 8, 8) for i in range(count)]
+
+# -- Benchmarks
+def bench_collision():
+    print('%-10s %-10s %14s %14s' % ('map', 'entities', 'linear ms/f', 'grid ms/f'))
+    for size in (16, 64, 256):
+        game_map = load_level(size)
+        for entities in (10, 100, 1000):
+            rects = random_rects(entities, size)
+            tile_rects = game_map.calculate_rects()
+
+            def linear():
+                # Two scans per move(), as the old check_collision did
+                for rect in rects:
+                    for i in range(2):
+                        [tile for tile in tile_rects if rect.colliderect(tile)]
+
+            def grid():
+                for rect in rects:
+                    for i in range(2):
+                        game_map.collide(rect)
+
+            repeat = 3 if size * entities > 10000 else 20
+            print('%-10s %-10d %14.3f %14.3f' % ('%dx%d' % (size, size), entities, timed(linear, repeat), timed(grid, repeat)))
+
+def bench_map_render():
+    display = pygame.Surface(game.DISPLAY_SIZE)
+    print('%-10s %16s %16s' % ('map', 'per-tile ms/f', 'baked ms/f'))
+    for size in (16, 64, 256):
+        game_map = load_level(size)
+
+        def per_tile():
+            # The old Map.render: one blit per solid tile of the whole map
+            y = 0
+            for row in game_map.game_map:
+                x = 0
+                for tile in row:
+                    if tile == 1:
+                        display.blit(game_map.img, (x * game_map.tile_size, y * game_map.tile_size))
+                    x += 1
+                y += 1
+
+        per_tile_ms = timed(per_tile)
+        game_map.render(display)
+        game_map.render_time = 0
+        game_map.render_count = 0
+        timed(lambda: game_map.render(display), 200)
+        print('%-10s %16.3f %16.3f' % ('%dx%d' % (size, size), per_tile_ms, game_map.average_render_time() * 1000))
+
+def bench_flip():
+    display = pygame.Surface(game.DISPLAY_SIZE)
+    frames = game.assets.load_animation('assets/graphics/enemies/zombie/walk', [6, 6, 6], (255, 0, 255)).frames
+    cached = {id(surface) for frame in frames for surface in frame}
+
+    def allocations(draw):
+        # Blitted surfaces are kept alive for the frame, so new ones are counted and traced, not recycled
+        # Bytes are the Python-side objects plus the list holding them; SDL pixel buffers are not traced
+        sources = []
+
+        def blit(source, dest):
+            sources.append(source)
+            display.blit(source, dest)
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        draw(blit)
+        size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        return len([source for source in sources if id(source) not in cached]), size
+
+    print('%-10s %14s %14s %12s %14s %14s %12s' % ('sprites', 'flip surf/f', 'flip bytes/f', 'flip ms/f',
+        'cached surf/f', 'cached bytes/f', 'cached ms/f'))
+    for sprites in (10, 100, 1000):
+        flips = [i % 2 == 0 for i in range(sprites)]
+
+        def per_frame_flip(blit = display.blit):
+            # The old render path: a new surface from transform.flip on every blit
+            for i in range(sprites):
+                img = frames[i % len(frames)][0]
+                blit(pygame.transform.flip(img, flips[i], False), (0, 0))
+
+        def cached_flip(blit = display.blit):
+            for i in range(sprites):
+                blit(frames[i % len(frames)][flips[i]], (0, 0))
+
+        flip_surfaces, flip_bytes = allocations(per_frame_flip)
+        cached_surfaces, cached_bytes = allocations(cached_flip)
+        print('%-10d %14d %14d %12.3f %14d %14d %12.3f' % (sprites, flip_surfaces, flip_bytes, timed(per_frame_flip),
+            cached_surfaces, cached_bytes, timed(cached_flip)))
+
+def bench_scenarios():
+    print('%-16s %10s %10s %10s %10s %10s' % ('scenario', 'ticks/s', 'upd p50', 'upd p99', 'rnd p50', 'rnd p99'))
+    run_scenario('idle', 600)
+    run_scenario('wander', 600, script = wander)
+    run_scenario('enemies_10', 600, enemies = 10)
+    run_scenario('enemies_100', 600, enemies = 100)
+    run_scenario('enemies_1000', 300, enemies = 1000)
+    run_scenario('shuriken_spam', 600, enemies = 100, script = shuriken_spam)
+
+def bench_enemies_vectorized():
+    g = game.Game(headless = True)
+    print('%-10s %16s %16s' % ('enemies', 'objects ms/upd', 'arrays ms/upd'))
+    for enemies in (100, 1000, 5000):
+        results = []
+        for vectorized in (False, True):
+            random.seed(0)
+            enemies_manager = game.EnemiesManager(vectorized)
+            for i in range(enemies):
+                enemies_manager.new_enemy()
+            results.append(timed(lambda: enemies_manager.update(g.game_map), 50))
+        print('%-10d %16.3f %16.3f' % (enemies, results[0], results[1]))
+
+def bench_pools():
+    g = game.Game(headless = True)
+    for i in range(100):
+        g.enemies_manager.new_enemy()
+    g.step(1200, shuriken_spam)
+    for name, stats in (('enemies', g.enemies_manager.stats()), ('projectiles', g.projectiles_manager.stats())):
+        print('%-12s live %5d  pooled %5d  created %6d  reused %6d  reuse rate %5.1f%%  peak %5d' % (name,
+            stats['live'], stats['pooled'], stats['created'], stats['reused'], stats['reuse_rate'] * 100, stats['peak']))
+
+class Body(object):
+    def __init__(self, rect):
+        self.rect = rect
+
+def bench_broad_phase():
+    print('%-12s %14s %14s' % ('proj x enem', 'all-pairs ms', 'hash ms'))
+    for count in (100, 1000):
+        projectiles = random_rects(count, 64, 2)
+        enemies = [Body(rect) for rect in random_rects(count, 64, 3)]
+        grid = game.SpatialHash()
+
+        def all_pairs():
+            for rect in projectiles:
+                [enemy for enemy in enemies if rect.colliderect(enemy.rect)]
+
+        def spatial_hash():
+            # Rebuilt every frame, as EnemiesManager does after its update
+            grid.clear()
+            for enemy in enemies:
+                grid.insert(enemy)
+            for rect in projectiles:
+                grid.collide(rect)
+
+        repeat = 3 if count > 100 else 20
+        print('%-12s %14.3f %14.3f' % ('%dx%d' % (count, count), timed(all_pairs, repeat), timed(spatial_hash, repeat)))
+
+def bench_level_load():
+    print('%-12s %12s %12s %12s %12s %12s' % ('map', 'old text ms', 'text ms', 'raw ms', 'rle ms', 'rle bytes'))
+    for size in (16, 256, 1024, 4096):
+        path = os.path.join(tempfile.mkdtemp(), 'level_' + str(size))
+        make_level(path, size)
+        width, height, data = game.read_text_level(path + '.dat')
+        game.write_level(path + '.lvl', width, height, data)
+        game.write_level(path + '_rle.lvl', width, height, data, True)
+
+        def old_text():
+            # The old Map.load_map: one list of one-character strings per row
+            game_map = []
+            with open(path + '.dat', 'r') as file:
+                for row in file.read().split('\n'):
+                    game_map.append(list(row))
+
+        repeat = 1 if size >= 1024 else 10
+        old_ms = timed(old_text, repeat) if size <= 1024 else float('nan')
+        text_ms = timed(lambda: game.Map(path), repeat)
+        raw_ms = timed(lambda: game.Map(path + '.lvl'), repeat)
+        rle_ms = timed(lambda: game.Map(path + '_rle.lvl'), repeat)
+        print('%-12s %12.3f %12.3f %12.3f %12.3f %12d' % ('%dx%d' % (size, size), old_ms, text_ms, raw_ms, rle_ms,
+            os.path.getsize(path + '_rle.lvl')))
+
+def bench_dirty_rects():
+    print('%-10s %-8s %14s %14s' % ('enemies', 'mode', 'render ms', 'pixels/frame'))
+    for enemies in (0, 10, 100):
+        for dirty in (False, True):
+            g = game.Game(headless = True)
+            g.dirty_rects = dirty
+            for i in range(enemies):
+                g.enemies_manager.new_enemy()
+            render_ms = 0
+            pixels = 0
+            for i in range(300):
+                g.step(1, wander)
+                g.present()
+                render_ms += g.render_time * 1000
+                pixels += g.pixels_pushed
+            print('%-10d %-8s %14.3f %14d' % (enemies, 'dirty' if dirty else 'full', render_ms / 300, pixels // 300))
+
+def bench_startup():
+    import atlas_maker
+    index_path = os.path.join(tempfile.mkdtemp(), 'atlas.json')
+    atlas_maker.build_atlas(index_path)
+    game.Game(headless = True)
+    print('%-8s %12s %14s' % ('loader', 'preload ms', 'files opened'))
+    for use_atlas in (False, True):
+        total = 0
+        for i in range(5):
+            assets = game.AssetsManager()
+            start = time.perf_counter()
+            if use_atlas:
+                assets.load_atlas(index_path)
+            assets.preload([entry for entry in game.ASSETS_MANIFEST if entry[0] != 'sound'])
+            total += time.perf_counter() - start
+        print('%-8s %12.3f %14d' % ('atlas' if use_atlas else 'files', total * 1000 / 5, assets.files_loaded))
+    for policy in ('eager', 'lazy', 'thread', 'demand'):
+        game.assets = game.AssetsManager()
+        g = game.Game(headless = True, loading_policy = policy)
+        g.step(1)
+        print('-- ' + g.startup_report().replace('\n', '\n   '))
+        while game.assets.pending and g.ticks < 1000:
+            g.step(1)
+        print('   all assets loaded after %d ticks' % g.ticks)
+
+def bench_spawn():
+    game.Game(headless = True)
+    enemies_manager = game.EnemiesManager()
+    start = time.perf_counter()
+    for i in range(10000):
+        enemies_manager.new_enemy()
+    fresh_us = (time.perf_counter() - start) * 1e6 / 10000
+    for enemy in enemies_manager.enemies:
+        enemy.dead = True
+    enemies_manager.pool.compact()
+    start = time.perf_counter()
+    for i in range(10000):
+        enemies_manager.new_enemy()
+    pooled_us = (time.perf_counter() - start) * 1e6 / 10000
+    print('new enemy %.2f us, pooled enemy %.2f us' % (fresh_us, pooled_us))
+
+def game_state(g):
+    return (tuple(g.player.rect), tuple(g.coin.rect), [tuple(enemy.rect) + (enemy.life,) for enemy in g.enemies_manager.enemies],
+            [tuple(projectile.rect) for projectile in g.projectiles_manager.projectiles])
+
+def bench_replay():
+    ticks = 3600
+    g = game.Game(headless = True, seed = 1234, record = True)
+    start = time.perf_counter()
+    g.step(ticks, wander)
+    live_s = time.perf_counter() - start
+    path = os.path.join(tempfile.mkdtemp(), 'session.rpl')
+    g.replay.save(path)
+    replay = game.load_replay(path)
+
+    start = time.perf_counter()
+    played = game.play_replay(replay)
+    replay_s = time.perf_counter() - start
+    print('%d ticks, replay file %d bytes, deterministic: %s' % (ticks, os.path.getsize(path), game_state(g) == game_state(played)))
+    print('recorded run %.3f s, playback without rendering %.3f s (%.0fx real time)' % (live_s, replay_s, ticks / 60 / replay_s))
+
+def bench_profiler():
+    g = game.Game(headless = True)
+    for i in range(100):
+        g.enemies_manager.new_enemy()
+    g.profiler.visible = True
+    g.step(game.PROFILER_FRAMES, shuriken_spam)
+    for name, average in g.profiler.averages().items():
+        print('%-20s %8.3f ms' % (name, average * 1000))
+    profiler = game.FrameProfiler()
+    profiler.begin_frame()
+    start = time.perf_counter()
+    for i in range(100000):
+        profiler.mark('phase', start)
+    mark_us = (time.perf_counter() - start) * 10
+    print('overhead %.2f us per phase, %.1f us per frame' % (mark_us, mark_us * len(g.profiler.phases)))
+    path = os.path.join(tempfile.mkdtemp(), 'trace')
+    g.profiler.export(path + '.json')
+    g.profiler.export(path + '.csv')
+    print('trace %d bytes, csv %d bytes' % (os.path.getsize(path + '.json'), os.path.getsize(path + '.csv')))
+
+def bench_fixed_step():
+    # Simulated frame costs: logic stays at TICK_RATE until the catch-up limit starts dropping ticks
+    print('frame ms   frames/s   ticks/s   dropped/s')
+    for frame_ms in (4, 16.7, 33, 50, 100, 250):
+        scheduler = game.FixedStep()
+        now = ticks = frames = 0
+        scheduler.advance(now)
+        while now < 10:
+            now += frame_ms / 1000
+            ticks += scheduler.advance(now)
+            frames += 1
+        print('%8.1f %10.1f %9.1f %11.1f' % (frame_ms, frames / now, ticks / now, scheduler.dropped / now))
+
+def bench_camera():
+    # Same enemy density on every map: render cost should track the view, not the world
+    print('%-10s %8s %12s %12s %16s' % ('map', 'enemies', 'render ms', 'update ms', 'update ms (flat)'))
+    for size in (16, 64, 256, 512):
+        enemies = size * size // 64
+        row = []
+        for interval in (game.OFFSCREEN_INTERVAL, 1):
+            g = game.Game(headless = True)
+            g.set_map(load_level(size))
+            g.enemies_manager.offscreen_interval = interval
+            rng = random.Random(size)
+            for i in range(enemies):
+                x, y = rng.randrange(1, size - 1), rng.randrange(1, size - 1)
+                g.enemies_manager.add_enemy(g.enemies_manager.enemy_names[i % 8], x * 8, y * 8, False)
+            render_ms = update_ms = 0
+            for i in range(120):
+                g.step(1, wander)
+                render_ms += g.render_time * 1000
+                update_ms += g.update_time * 1000
+            row.append((render_ms / 120, update_ms / 120))
+        print('%-10s %8d %12.3f %12.3f %16.3f' % ('%dx%d' % (size, size), enemies, row[0][0], row[0][1], row[1][1]))
+
+def bench_present():
+    print('%-6s %-10s %14s %14s %14s' % ('scale', 'window', 'alloc ms', 'dest ms', 'SCALED ms'))
+    for scale in range(2, 9):
+        window_size = (game.DISPLAY_SIZE[0] * scale, game.DISPLAY_SIZE[1] * scale)
+        # A window cannot switch to SCALED in place, so each mode gets a fresh display
+        pygame.display.quit()
+        pygame.display.init()
+        screen = pygame.display.set_mode(window_size, 0, 32)
+        display = pygame.Surface(game.DISPLAY_SIZE, 0, screen)
+        load_level(16).render(display)
+
+        def alloc():
+            # The old present: a new window-sized surface every frame, then a blit
+            screen.blit(pygame.transform.scale(display, window_size), (0, 0))
+            pygame.display.update()
+
+        def dest():
+            pygame.transform.scale(display, window_size, screen)
+            pygame.display.update()
+
+        alloc_ms = timed(alloc, 100)
+        dest_ms = timed(dest, 100)
+        pygame.display.quit()
+        pygame.display.init()
+        scaled = pygame.display.set_mode(game.DISPLAY_SIZE, pygame.SCALED, 32)
+        scaled.blit(display, (0, 0))
+        scaled_ms = timed(pygame.display.flip, 100)
+        print('%-6d %-10s %14.3f %14.3f %14.3f' % (scale, '%dx%d' % window_size, alloc_ms, dest_ms, scaled_ms))
+
+def bench_sounds():
+    # A heavy wave: every frame dozens of enemies get hit and shurikens crash at once.
+    # Frames are paced in real time so voices finish and free their channels as in game
+    game.Game(headless = True)
+    wave = ['hurt_1', 'hurt_2'] * 20 + ['crash'] * 20 + ['throw'] * 5
+    frames = 90
+    bare = {name: game.assets.load_sound(game.SOUNDS[name][0]) for name in game.SOUNDS}
+    sounds = game.SoundsManager()
+    print('%-8s %14s %10s %10s %14s' % ('mode', 'play ms/frame', 'started', 'dropped', 'busy channels'))
+    for managed in (False, True):
+        pygame.mixer.stop()
+        # The manager reserves its group channels; bare play needs them unreserved
+        pygame.mixer.set_reserved(0)
+        if managed:
+            sounds.reserve()
+        play_ms = busy = started = 0
+        for i in range(frames):
+            frame_start = time.perf_counter()
+            for name in wave:
+                if managed:
+                    channel = sounds.play(name)
+                else:
+                    channel = bare[name].play()
+                started += channel is not None
+            if managed:
+                sounds.end_frame()
+            play_ms += (time.perf_counter() - frame_start) * 1000
+            busy += sum([pygame.mixer.Channel(c).get_busy() for c in range(pygame.mixer.get_num_channels())])
+            time.sleep(max(0, 1 / 60 - (time.perf_counter() - frame_start)))
+        print('%-8s %14.3f %10d %10d %14.1f' % ('managed' if managed else 'bare', play_ms / frames, started,
+            frames * len(wave) - started, busy / frames))
+    print('managed: %.0f played/s, %.0f culled/s' % (sounds.played_per_second, sounds.culled_per_second))
+
+class PolledTimer(object):
+    # The old Timer: every instance is updated every tick, due or not
+    def __init__(self, ticks, autostart, loop):
+        self.ticks = ticks
+        self.curr_tick = 0
+        self.enabled = False
+        self.loop = loop
+        self.active = autostart
+
+    def update(self):
+        if self.active:
+            self.curr_tick += 1
+            if self.curr_tick >= self.ticks:
+                self.enabled = True
+                self.curr_tick = 0
+                self.active = False
+                if self.loop:
+                    self.active = True
+            else:
+                self.enabled = False
+
+class CountedTimer(game.Timer):
+    fires = 0
+
+    def fire(self):
+        CountedTimer.fires += 1
+        game.Timer.fire(self)
+
+def bench_timers():
+    count = 10000
+    ticks = 600
+    rng = random.Random(0)
+    durations = [rng.randint(5, 300) for i in range(count)]
+    print('%-24s %12s %12s' % ('10k timers', 'us/tick', 'fired'))
+    for loop in (True, False):
+        polled = [PolledTimer(duration, True, loop) for duration in durations]
+        fired = 0
+        start = time.perf_counter()
+        for tick in range(ticks):
+            for timer in polled:
+                was_active = timer.active
+                timer.update()
+                if was_active and timer.curr_tick == 0:
+                    fired += 1
+        print('%-24s %12.1f %12d' % ('polled ' + ('loop' if loop else 'one-shot'), (time.perf_counter() - start) * 1e6 / ticks, fired))
+
+        wheel = game.TimerWheel()
+        CountedTimer.fires = 0
+        wheel_timers = [CountedTimer(duration, True, loop, wheel) for duration in durations]
+        start = time.perf_counter()
+        for tick in range(ticks):
+            wheel.advance()
+        print('%-24s %12.1f %12d' % ('wheel ' + ('loop' if loop else 'one-shot'), (time.perf_counter() - start) * 1e6 / ticks, CountedTimer.fires))
+
+    # Churn: 1% of timers cancelled and restarted every tick, as hurt/kill timers are under fire
+    wheel = game.TimerWheel()
+    wheel_timers = [game.Timer(duration, True, False, wheel) for duration in durations]
+    start = time.perf_counter()
+    for tick in range(ticks):
+        for i in range(count // 100):
+            wheel_timers[rng.randrange(count)].restart()
+        wheel.advance()
+    print('%-24s %12.1f %12d' % ('wheel 1% restart/tick', (time.perf_counter() - start) * 1e6 / ticks, len(wheel)))
+
+def old_animation_db(animation):
+    # The old layout: one frame id per tick of the animation, and a dict from id to frame images
+    frame_ids = ['frame_' + str(n) for n in range(len(animation.frames))]
+    animation_frames = dict(zip(frame_ids, animation.frames))
+    frame_data = []
+    start = 0
+    for n, end in enumerate(animation.ends):
+        frame_data.extend([frame_ids[n]] * (end - start))
+        start = end
+    return animation_frames, frame_data
+
+def bench_animations():
+    game.Game(headless = True)
+    animations = {}
+    for entry in game.ASSETS_MANIFEST:
+        if entry[0] == 'animation':
+            animations[entry[1]] = game.assets.load_animation(*entry[1:])
+    old_bytes = new_bytes = 0
+    for animation in animations.values():
+        animation_frames, frame_data = old_animation_db(animation)
+        old_bytes += sys.getsizeof(frame_data) + sys.getsizeof(animation_frames)
+        new_bytes += sys.getsizeof(animation.ends) + sys.getsizeof(animation.frames)
+    print('%d animations: frame-id lists %d bytes, cumulative tables %d bytes' % (len(animations), old_bytes, new_bytes))
+
+    # Per sprite the old path bumps a frame counter and does two lookups; the clock path computes the frame
+    class Sprite(object):
+        pass
+    print('%-10s %14s %14s %18s' % ('sprites', 'old us/frame', 'clock us/frame', 'batch select us'))
+    for sprites in (100, 1000, 10000):
+        rng = random.Random(sprites)
+        sprite_list = []
+        for i in range(sprites):
+            animation = list(animations.values())[i % len(animations)]
+            sprite = Sprite()
+            sprite.animation = animation
+            sprite.animation_frames, sprite.frame_data = old_animation_db(animation)
+            sprite.frame = 0
+            sprite.animation_start = rng.randrange(1000)
+            sprite.flip = i % 2 == 0
+            sprite_list.append(sprite)
+        now = 5000
+
+        def old():
+            for sprite in sprite_list:
+                sprite.frame += 1
+                if sprite.frame >= len(sprite.frame_data):
+                    sprite.frame = 0
+                img = sprite.animation_frames[sprite.frame_data[sprite.frame]][sprite.flip]
+
+        def clock():
+            for sprite in sprite_list:
+                img = sprite.animation.image(now - sprite.animation_start, sprite.flip)
+
+        groups = {}
+        for sprite in sprite_list:
+            groups.setdefault(sprite.animation, []).append(sprite.animation_start)
+        # Start ticks kept in arrays, as a struct-of-arrays renderer would hold them
+        groups = [(animation, numpy.array(starts)) for animation, starts in groups.items()] if numpy is not None else None
+
+        def batch():
+            for animation, starts in groups:
+                indices = animation.indices(now - starts)
+
+        batch_us = timed(batch) * 1000 if groups is not None else float('nan')
+        print('%-10d %14.1f %14.1f %18.1f' % (sprites, timed(old) * 1000, timed(clock) * 1000, batch_us))
+
+def rejection_sample(game_map, rng):
+    # The obvious fix: draw random cells until one is free with solid ground below
+    tries = 0
+    while True:
+        tries += 1
+        x, y = rng.randrange(game_map.width), rng.randrange(game_map.height - 1)
+        if game_map.game_map[y][x] == 0 and game_map.game_map[y + 1][x] != 0:
+            return (x, y), tries
+
+def bench_placement():
+    print('%-10s %10s %10s %10s %12s %12s %10s %12s %10s %12s' % ('map', 'standable', 'load ms', 'index ms', 'reject us',
+        'tries/draw', 'map us', 'view us', 'in view', 'set_tile us'))
+    for size in (64, 256, 1024):
+        path = os.path.join(tempfile.mkdtemp(), 'sparse_' + str(size))
+        make_level(path, size, density = 0.01, seed = size)
+        load_ms = timed(lambda: game.Map(path), 3)
+        game_map = game.Map(path)
+
+        def index_all():
+            game_map.standable = None
+            game_map.random_standable()
+        # The whole-map index is built on the first whole-map draw; regions piecemeal as areas are drawn from
+        index_ms = timed(index_all, 3)
+        rng = random.Random(0)
+        draws = 2000
+        start = time.perf_counter()
+        for i in range(draws):
+            game_map.random_standable()
+        map_us = (time.perf_counter() - start) * 1e6 / draws
+        tries = 0
+        start = time.perf_counter()
+        for i in range(draws):
+            tries += rejection_sample(game_map, rng)[1]
+        reject_us = (time.perf_counter() - start) * 1e6 / draws
+        view = pygame.Rect(0, 0, 128, 128)
+        inside = drawn = 0
+        start = time.perf_counter()
+        for i in range(draws):
+            view.topleft = (rng.randrange(size * 8 - 128), rng.randrange(size * 8 - 128))
+            cell = game_map.random_standable(view)
+            if cell is not None:
+                drawn += 1
+                inside += view.contains((cell[0] * 8, cell[1] * 8, 8, 8))
+        index_us = (time.perf_counter() - start) * 1e6 / draws
+        start = time.perf_counter()
+        for i in range(draws):
+            game_map.set_tile(rng.randrange(1, size - 1), rng.randrange(1, size - 1), rng.randrange(2))
+        set_us = (time.perf_counter() - start) * 1e6 / draws
+        print('%-10s %10d %10.2f %10.2f %12.2f %12.1f %10.2f %12.2f %9.0f%% %12.2f' % ('%dx%d' % (size, size),
+            len(game_map.standable_cells()), load_ms, index_ms, reject_us, tries / draws, map_us, index_us,
+            inside * 100 / drawn, set_us))
+
+def search_path(navigator, start, goal):
+    # One BFS per enemy, stopping when it reaches the enemy's cell
+    seen = {goal}
+    queue = collections.deque([goal])
+    while queue:
+        cell = queue.popleft()
+        if cell == start:
+            return True
+        for source, move in navigator.incoming.get(cell, ()):
+            if source not in seen:
+                seen.add(source)
+                queue.append(source)
+    return False
+
+def bench_navigation():
+    size = 256
+    game_map = load_level(size)
+    navigator = game.Navigator(game_map)
+    build_ms = timed(navigator.build, 3)
+    links = sum(len(sources) for sources in navigator.incoming.values())
+    rng = random.Random(0)
+    standable = game_map.standable_cells()
+    goals = [standable[rng.randrange(len(standable))] for i in range(20)]
+    routed = []
+    start = time.perf_counter()
+    for goal in goals:
+        navigator.goal = goal
+        navigator.recompute()
+        routed.append(len(navigator.field) - navigator.field.count(0))
+    field_ms = (time.perf_counter() - start) * 1000 / len(goals)
+    # Benchmark against the goal in the largest connected area of the noise map
+    goal = goals[routed.index(max(routed))]
+    print('map %dx%d: %d cells, %d links, build %.2f ms, field %.2f ms, up to %d cells routed' % (size, size,
+        len(standable), links, build_ms, field_ms, max(routed)))
+
+    # The player walking along a floor only moves the goal when it changes cell
+    player = pygame.Rect(0, 0, 8, 8)
+    navigator.goal = None
+    changes = 0
+    for tick in range(600):
+        player.topleft = (goal[0] * 8 + tick // 2 % 64, goal[1] * 8)
+        changes += navigator.set_goal(player)
+    print('600 player ticks: %d field recomputes' % changes)
+
+    enemies = 1000
+    navigator.goal = goal
+    navigator.recompute()
+    reachable = [cell for cell in standable if navigator.field[cell[1] * size + cell[0]]]
+    starts = [reachable[rng.randrange(len(reachable))] for i in range(20)]
+    start = time.perf_counter()
+    for cell in starts:
+        search_path(navigator, cell, goal)
+    search_ms = (time.perf_counter() - start) * 1000 / len(starts) * enemies
+    print('per-enemy search for %d enemies: %.1f ms/upd, flow field: %.2f ms per player cell change' % (enemies,
+        search_ms, field_ms))
+
+    print('%-10s %16s %16s' % ('chase', 'objects ms/upd', 'arrays ms/upd'))
+    for chase in (False, True):
+        results = []
+        for vectorized in (False, True):
+            random.seed(0)
+            game.timers.clear()
+            enemies_manager = game.EnemiesManager(vectorized)
+            enemies_manager.spawn_map = game_map
+            if chase:
+                enemies_manager.navigator = navigator
+            for i in range(enemies):
+                enemies_manager.new_enemy()
+            results.append(timed(lambda: enemies_manager.update(game_map), 50))
+        print('%-10s %16.3f %16.3f' % (chase, results[0], results[1]))
+
+    # Timing alone says nothing about whether chasers arrive: race routed enemies to a standing player
+    size = 64
+    game_map = load_level(size)
+    navigator = game.Navigator(game_map)
+    standable = game_map.standable_cells()
+    best = None
+    for goal in standable[::max(len(standable) // 20, 1)]:
+        navigator.goal = None
+        navigator.set_goal(pygame.Rect(goal[0] * 8, goal[1] * 8, 8, 8))
+        routed = [cell for cell in standable if navigator.field[cell[1] * size + cell[0]]]
+        if best is None or len(routed) > len(best[1]):
+            best = goal, routed
+    goal, routed = best
+    player = pygame.Rect(goal[0] * 8, goal[1] * 8, 8, 8)
+    print('%-10s %10s %10s %16s' % ('path', 'enemies', 'reached', 'median updates'))
+    for vectorized in (False, True):
+        rng = random.Random(1)
+        game.timers.clear()
+        enemies_manager = game.EnemiesManager(vectorized)
+        enemies_manager.navigator = navigator
+        enemies_manager.spawn_timer.cancel()
+        navigator.goal = None
+        navigator.set_goal(player)
+        for i in range(200):
+            cell = routed[rng.randrange(len(routed))]
+            enemies_manager.add_enemy('zombie', cell[0] * 8, cell[1] * 8, False)
+        chasers = list(enemies_manager.enemies)
+        arrived = {}
+        for tick in range(3000):
+            enemies_manager.update(game_map)
+            for enemy in chasers:
+                if enemy not in arrived and enemy.rect.colliderect(player):
+                    arrived[enemy] = tick
+            if len(arrived) == len(chasers):
+                break
+        ticks = sorted(arrived.values())
+        print('%-10s %10d %9.0f%% %16d' % ('arrays' if vectorized else 'objects', len(chasers),
+            len(arrived) * 100 / len(chasers), percentile(ticks, 50) if ticks else -1))
+
+def dict_backed(cls):
+    # The same class without __slots__, as the entities were before
+    namespace = {name: value for name, value in vars(cls).items()
+                 if name not in ('__slots__', '__dict__', '__weakref__') and not isinstance(value, types.MemberDescriptorType)}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+def allocated(make, count):
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    entities = [make() for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return size / len(entities)
+
+def bench_memory():
+    game.Game(headless = True)
+    enemy_type = game.enemy_types['zombie']
+    timer = game.Timer
+    dict_timer = dict_backed(timer)
+    entities = [('timer', timer, dict_timer, (5, False, False)),
+                ('enemy', game.Enemy, dict_backed(game.Enemy), (enemy_type, 0, 0, False)),
+                ('shuriken', game.Shuriken, dict_backed(game.Shuriken), (0, 0, False))]
+    print('%-10s %16s %16s' % ('entity', 'dict bytes', 'slots bytes'))
+    for name, cls, dict_cls, args in entities:
+        slots = allocated(lambda: cls(*args), 10000)
+        # Enemies build their timers through the module global
+        game.Timer = dict_timer
+        try:
+            before = allocated(lambda: dict_cls(*args), 10000)
+        finally:
+            game.Timer = timer
+        print('%-10s %16.0f %16.0f' % (name, before, slots))
+
+def bench_snapshot():
+    print('%-10s %12s %14s %14s' % ('enemies', 'bytes', 'snapshot us', 'restore us'))
+    for enemies in (0, 100, 1000):
+        g = game.Game(headless = True, seed = 1)
+        for i in range(enemies):
+            g.enemies_manager.new_enemy()
+        g.step(120, wander)
+        data = g.snapshot()
+        snapshot_us = timed(g.snapshot, 200) * 1000
+        restore_us = timed(lambda: g.restore(data), 200) * 1000
+        print('%-10d %12d %14.1f %14.1f' % (len(g.enemies_manager.enemies), len(data), snapshot_us, restore_us))
+
+BENCHMARKS = {
+    'collision': bench_collision,
+    'map_render': bench_map_render,
+    'flip': bench_flip,
+    'scenarios': bench_scenarios,
+    'enemies_vectorized': bench_enemies_vectorized,
+    'pools': bench_pools,
+    'broad_phase': bench_broad_phase,
+    'level_load': bench_level_load,
+    'dirty_rects': bench_dirty_rects,
+    'startup': bench_startup,
+    'spawn': bench_spawn,
+    'replay': bench_replay,
+    'profiler': bench_profiler,
+    'fixed_step': bench_fixed_step,
+    'camera': bench_camera,
+    'present': bench_present,
+    'sounds': bench_sounds,
+    'timers': bench_timers,
+    'animations': bench_animations,
+    'placement': bench_placement,
+    'navigation': bench_navigation,
+    'memory': bench_memory,
+    'snapshot': bench_snapshot,
+}
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    game.Game(headless = True)
+    for name in names:
+        print('-- ' + name)
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main()
@@ -1,144 +1,747 @@
-import pygame, sys, random
+import pygame, sys, os, io, random, time, mmap, struct, json, threading, collections, zlib, heapq, bisect
 from pygame.locals import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 SCALE = 4
-WINDOW_SIZE = (128 * SCALE, 128 * SCALE)
 DISPLAY_SIZE = (128, 128)
 GRAVITY = 0.5
+# 'scale' upscales the display into the preallocated window surface, 'scaled' leaves it to SDL's SCALED mode
+PRESENT_MODE = 'scale'
+SPAWN_INTERVAL = (60, 120)
+# 'eager' loads ASSETS_MANIFEST before the first frame, 'lazy' spreads it over frames,
+# 'thread' decodes files on a worker thread and 'demand' loads each asset on first use
+LOADING_POLICY = 'eager'
+LOADING_BUDGET = 0.002
+ATLAS_INDEX = 'assets/atlas.json'
+VECTORIZED_ENEMIES = False
+DIRTY_RECTS = False
+BACKGROUND_COLOR = (24, 28, 41)
+FRAME_BUDGET = 1 / 60
+PROFILER_FRAMES = 240
+# name: (path, channel group, max simultaneous voices); each group gets its own reserved mixer channels
+SOUNDS = {
+    'jump': ('assets/sfx/sounds/jump.ogg', 'player', 1),
+    'throw': ('assets/sfx/sounds/throw.ogg', 'player', 2),
+    'pickup': ('assets/sfx/sounds/pickup.ogg', 'pickups', 1),
+    'hurt_1': ('assets/sfx/sounds/hurt_1.ogg', 'enemies', 2),
+    'hurt_2': ('assets/sfx/sounds/hurt_2.ogg', 'enemies', 2),
+    'crash': ('assets/sfx/sounds/crash.ogg', 'weapons', 2),
+}
+CHANNEL_GROUPS = {'player': 2, 'pickups': 1, 'enemies': 3, 'weapons': 2}
+# Logic runs at TICK_RATE whatever the frame rate; each subsystem updates every N ticks
+TICK_RATE = 60
+MAX_CATCHUP = 5
+RENDER_FPS = 120
+UPDATE_INTERVALS = {'player': 1, 'projectiles': 1, 'enemies': 2}
+# Enemies further than CAMERA_MARGIN outside the view only update every OFFSCREEN_INTERVAL enemy updates
+CAMERA_MARGIN = 32
+OFFSCREEN_INTERVAL = 4
+# Chasing enemies read their next move from a flow field toward the player's cell
+CHASE_PLAYER = False
+NAV_LEFT = 1
+NAV_RIGHT = 2
+NAV_JUMP = 4
 
 # -- Classes
 class Timer(object):
-    def __init__(self, ticks, autostart, loop):
+    # A deadline on a TimerWheel: nothing runs between firings, the state below is derived from the wheel
+    __slots__ = ('ticks', 'loop', 'autostart', 'wheel', 'deadline', 'fired', 'generation')
+
+    def __init__(self, ticks, autostart, loop, wheel = None):
         self.ticks = ticks
-        self.curr_tick = 0
-        self.enabled = False
         self.loop = loop
-        self.active = autostart
+        self.autostart = autostart
+        self.wheel = wheel if wheel is not None else timers
+        self.deadline = None
+        self.fired = None
+        self.generation = 0
+        if autostart:
+            self.start()
 
-    def update(self):
-        if self.active:
-            self.curr_tick += 1
-            if self.curr_tick >= self.ticks:
-                self.enabled = True
-                self.curr_tick = 0
-                self.active = False
-                if self.loop:
-                    self.active = True
+    @property
+    def active(self):
+        return self.deadline is not None
+
+    @property
+    def enabled(self):
+        # One-shot timers stay enabled once fired; looping ones only on the tick they fire
+        return self.fired is not None and (not self.loop or self.fired == self.wheel.now)
+
+    @property
+    def curr_tick(self):
+        if self.deadline is None:
+            return 0
+        return self.wheel.now - self.deadline + self.ticks
+
+    def start(self):
+        if self.deadline is None:
+            self.fired = None
+            self.deadline = self.wheel.now + self.ticks
+            self.wheel.schedule(self)
+
+    def restart(self, ticks = None):
+        self.cancel()
+        if ticks is not None:
+            self.ticks = ticks
+        self.start()
+
+    def cancel(self):
+        if self.deadline is not None:
+            self.deadline = None
+            self.generation += 1
+            self.wheel.cancelled += 1
+
+    def reset(self):
+        self.cancel()
+        self.fired = None
+        if self.autostart:
+            self.start()
+
+    def state(self):
+        return (self.ticks, -1 if self.deadline is None else self.deadline, -1 if self.fired is None else self.fired)
+
+    def set_state(self, ticks, deadline, fired):
+        # Expects a cleared wheel, as in Game.restore
+        self.ticks = ticks
+        self.deadline = None if deadline < 0 else deadline
+        self.fired = None if fired < 0 else fired
+        if self.deadline is not None:
+            self.wheel.schedule(self)
+
+    def fire(self):
+        self.fired = self.wheel.now
+        self.deadline = None
+        if self.loop:
+            self.start()
+            self.fired = self.wheel.now
+
+class TimerWheel(object):
+    # Pending deadlines in a heap; advance() only touches the timers that come due.
+    # Cancelled entries stay in the heap until popped or swept
+    def __init__(self):
+        self.now = 0
+        self.heap = []
+        self.sequence = 0
+        self.cancelled = 0
+
+    def schedule(self, timer):
+        self.sequence += 1
+        heapq.heappush(self.heap, (timer.deadline, self.sequence, timer, timer.generation))
+        if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if entry[3] == entry[2].generation]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def advance(self, ticks = 1):
+        self.now += ticks
+        heap = self.heap
+        while heap and heap[0][0] <= self.now:
+            deadline, sequence, timer, generation = heapq.heappop(heap)
+            if generation == timer.generation:
+                timer.fire()
             else:
-                self.enabled = False
+                self.cancelled -= 1
 
-class Coin(object):
+    def clear(self):
+        # Dropped timers are disarmed, so cancelling them later does not count against the heap
+        for deadline, sequence, timer, generation in self.heap:
+            if generation == timer.generation:
+                timer.deadline = None
+                timer.generation += 1
+        self.heap = []
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+class Clock(object):
+    # Simulated tick count; animations are picked from it instead of counting their own frames
+    def __init__(self):
+        self.now = 0
+
+class FixedStep(object):
+    # Accumulates real time and hands out whole logic ticks, at most max_steps per frame
+    def __init__(self, rate = TICK_RATE, max_steps = MAX_CATCHUP):
+        self.dt = 1 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.last = None
+        self.dropped = 0
+
+    def advance(self, now):
+        if self.last is None:
+            self.last = now
+        self.accumulator += now - self.last
+        self.last = now
+        steps = int(self.accumulator / self.dt)
+        if steps > self.max_steps:
+            # Too far behind to catch up: drop the backlog instead of spiralling
+            self.dropped += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator %= self.dt
+        else:
+            self.accumulator -= steps * self.dt
+        return steps
+
+    def alpha(self):
+        return self.accumulator / self.dt
+
+def interpolate(entity, alpha):
+    if alpha >= 1:
+        return entity.rect.topleft
+    x, y = entity.last_pos
+    return (round(x + (entity.rect.x - x) * alpha), round(y + (entity.rect.y - y) * alpha))
+
+class Camera(object):
+    # Display-sized window onto the world, kept centred on a target and inside the map
+    def __init__(self, size = DISPLAY_SIZE, margin = CAMERA_MARGIN):
+        self.rect = pygame.Rect((0, 0), size)
+        self.last_pos = self.rect.topleft
+        self.margin = margin
+
+    def follow(self, target, bounds):
+        self.last_pos = self.rect.topleft
+        self.rect.center = target.center
+        self.rect.clamp_ip(bounds)
+
+    def active_rect(self):
+        return self.rect.inflate(self.margin * 2, self.margin * 2)
+
+    def view(self, alpha = 1):
+        return pygame.Rect(interpolate(self, alpha), self.rect.size)
+
+class EntityPool(object):
+    # Live entities plus per-class free lists; dead entities are recycled by compact()
     def __init__(self):
+        self.live = []
+        self.free = {}
+        self.created = 0
+        self.reused = 0
+        self.peak = 0
+
+    def spawn(self, cls, *args):
+        free = self.free.get(cls)
+        if free:
+            entity = free.pop()
+            entity.reset(*args)
+            self.reused += 1
+        else:
+            entity = cls(*args)
+            self.created += 1
+        self.live.append(entity)
+        if len(self.live) > self.peak:
+            self.peak = len(self.live)
+        return entity
+
+    def recycle(self, cls):
+        # A free entity for the caller to overwrite, skipping reset(); None when there is none
+        free = self.free.get(cls)
+        if not free:
+            return None
+        entity = free.pop()
+        self.reused += 1
+        self.live.append(entity)
+        if len(self.live) > self.peak:
+            self.peak = len(self.live)
+        return entity
+
+    def compact(self, on_release = None):
+        live = self.live
+        j = 0
+        for entity in live:
+            if entity.dead:
+                self.free.setdefault(type(entity), []).append(entity)
+                if on_release is not None:
+                    on_release(entity)
+            else:
+                live[j] = entity
+                j += 1
+        del live[j:]
+
+    def stats(self):
+        spawned = self.created + self.reused
+        return {'live': len(self.live), 'pooled': sum([len(free) for free in self.free.values()]),
+                'created': self.created, 'reused': self.reused,
+                'reuse_rate': self.reused / spawned if spawned else 0, 'peak': self.peak}
+
+class SpatialHash(object):
+    # Uniform grid of moving objects, keyed by cell; objects need a rect attribute
+    def __init__(self, cell_size = 16):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, obj):
+        rect = obj.rect
+        cs = self.cell_size
+        for cy in range(rect.top // cs, (rect.bottom - 1) // cs + 1):
+            for cx in range(rect.left // cs, (rect.right - 1) // cs + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is None:
+                    self.cells[(cx, cy)] = [obj]
+                else:
+                    bucket.append(obj)
+
+    def collide(self, rect):
+        hit_list = []
+        cs = self.cell_size
+        for cy in range(rect.top // cs, (rect.bottom - 1) // cs + 1):
+            for cx in range(rect.left // cs, (rect.right - 1) // cs + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is not None:
+                    for obj in bucket:
+                        if rect.colliderect(obj.rect) and not obj in hit_list:
+                            hit_list.append(obj)
+        return hit_list
+
+class Animation(object):
+    # Frames as (image, flipped image) plus the tick at which each frame ends, cumulatively
+    def __init__(self, frames, durations):
+        self.frames = frames
+        self.ends = []
+        total = 0
+        for duration in durations:
+            total += duration
+            self.ends.append(total)
+        self.length = total
+        # Equal durations, the common case, need a division instead of a search
+        self.step = durations[0] if len(set(durations)) == 1 else 0
+        self.ends_array = numpy.array(self.ends) if numpy is not None else None
+
+    def index(self, elapsed):
+        if self.step:
+            return elapsed % self.length // self.step
+        return bisect.bisect_right(self.ends, elapsed % self.length)
+
+    def image(self, elapsed, flip = False):
+        return self.frames[self.index(elapsed)][flip]
+
+    def indices(self, elapsed):
+        # Frame index for a whole batch of sprites playing this animation
+        if self.ends_array is None:
+            return [self.index(ticks) for ticks in elapsed]
+        return numpy.searchsorted(self.ends_array, numpy.asarray(elapsed) % self.length, side = 'right')
+
+class AssetsManager(object):
+    def __init__(self):
+        self.images = {}
+        self.animations = {}
+        self.sounds = {}
+        self.hits = 0
+        self.misses = 0
+        self.files_loaded = 0
+        self.atlas = None
+        self.atlas_animations = {}
+        self.decode_time = 0
+        self.pending = collections.deque()
+        self.decoded = {}
+        self.worker = None
+        self.worker_done = 0
+        self.pending_done = 0
+
+    def load_atlas(self, index_path):
+        # Built by atlas_maker.py: one image holding every animation frame plus a JSON index
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        self.atlas = pygame.image.load(os.path.join(os.path.dirname(index_path), index['image'])).convert()
+        self.files_loaded += 1
+        self.atlas_animations = index['animations']
+
+    def load_image(self, path, colorkey = None, convert = False):
+        key = (path, colorkey, convert)
+        if key in self.images:
+            self.hits += 1
+            return self.images[key]
+        self.misses += 1
+        start = time.perf_counter()
+        decoded = self.decoded.pop(path, None)
+        if decoded is not None:
+            img = pygame.image.frombytes(*decoded)
+        else:
+            img = pygame.image.load(path)
+        self.files_loaded += 1
+        if convert:
+            img = img.convert()
+        if colorkey is not None:
+            img.set_colorkey(colorkey)
+        self.images[key] = img
+        self.decode_time += time.perf_counter() - start
+        return img
+
+    def load_animation(self, path, duration, colorkey):
+        key = (path, tuple(duration), colorkey)
+        if key in self.animations:
+            self.hits += 1
+            return self.animations[key]
+        self.misses += 1
+        animation_name = path.split('/')[-1]
+        atlas_frames = self.atlas_animations.get(path, {}).get('frames', {})
+        animation_frames = []
+        n = 0
+        for frame in duration:
+            animation_frame_id = animation_name + '_' + str(n)
+            if animation_frame_id in atlas_frames:
+                animation_image = self.atlas.subsurface(atlas_frames[animation_frame_id])
+                if colorkey is not None:
+                    animation_image.set_colorkey(colorkey)
+            else:
+                img_location = path + '/' + animation_frame_id + '.png'
+                animation_image = self.load_image(img_location, colorkey, True)
+            # Indexed by the sprite's flip flag: (right-facing, left-facing)
+            animation_frames.append((animation_image, self.flip_image(animation_image, colorkey)))
+            n += 1
+        self.animations[key] = Animation(animation_frames, duration)
+        return self.animations[key]
+
+    def flip_image(self, img, colorkey = None):
+        flipped = pygame.transform.flip(img, True, False)
+        if colorkey is not None:
+            flipped.set_colorkey(colorkey)
+        return flipped
+
+    def load_sound(self, path):
+        if path in self.sounds:
+            self.hits += 1
+            return self.sounds[path]
+        self.misses += 1
+        start = time.perf_counter()
+        decoded = self.decoded.pop(path, None)
+        self.sounds[path] = pygame.mixer.Sound(io.BytesIO(decoded) if decoded is not None else path)
+        self.decode_time += time.perf_counter() - start
+        return self.sounds[path]
+
+    def preload(self, manifest):
+        for entry in manifest:
+            match entry[0]:
+                case 'image':
+                    self.load_image(*entry[1:])
+                case 'animation':
+                    self.load_animation(*entry[1:])
+                case 'sound':
+                    self.load_sound(*entry[1:])
+
+    def entry_files(self, entry):
+        match entry[0]:
+            case 'animation':
+                path, duration = entry[1], entry[2]
+                animation_name = path.split('/')[-1]
+                atlas_frames = self.atlas_animations.get(path, {}).get('frames', {})
+                return [path + '/' + animation_name + '_' + str(n) + '.png' for n in range(len(duration))
+                        if not animation_name + '_' + str(n) in atlas_frames]
+            case _:
+                return [entry[1]]
+
+    def queue(self, manifest):
+        self.pending.extend(manifest)
+
+    def start_worker(self, manifest):
+        # The worker only reads and decodes files; surfaces are created on the main thread
+        entries = list(manifest)
+        self.queue(entries)
+
+        def work():
+            for entry in entries:
+                for path in self.entry_files(entry):
+                    if entry[0] == 'sound':
+                        with open(path, 'rb') as file:
+                            self.decoded[path] = file.read()
+                    else:
+                        img = pygame.image.load(path)
+                        fmt = 'RGBA' if img.get_flags() & SRCALPHA else 'RGB'
+                        self.decoded[path] = (pygame.image.tobytes(img, fmt), img.get_size(), fmt)
+                self.worker_done += 1
+        self.worker = threading.Thread(target = work, daemon = True)
+        self.worker.start()
+
+    def preload_step(self, budget = LOADING_BUDGET):
+        start = time.perf_counter()
+        while self.pending and time.perf_counter() - start < budget:
+            if self.worker is not None and self.pending_done >= self.worker_done:
+                break
+            entry = self.pending.popleft()
+            self.preload([entry])
+            self.pending_done += 1
+            # Drop bytes the worker decoded for an asset that was already loaded on demand
+            for path in self.entry_files(entry):
+                self.decoded.pop(path, None)
+
+    def stats(self):
+        return {'images': len(self.images), 'animations': len(self.animations), 'sounds': len(self.sounds),
+                'hits': self.hits, 'misses': self.misses, 'files_loaded': self.files_loaded,
+                'pending': len(self.pending), 'decode_time': self.decode_time}
+
+class SoundsManager(object):
+    # Plays SOUNDS by name; a play is culled if the sound already started this frame or is at its voice cap
+    def __init__(self, groups = CHANNEL_GROUPS):
+        self.group_sizes = groups
+        self.groups = None
+        self.sounds = {}
+        self.frame_played = set()
+        self.played = 0
+        self.culled = 0
+        self.second_start = None
+        self.second_played = 0
+        self.second_culled = 0
+        self.played_per_second = 0
+        self.culled_per_second = 0
+
+    def reserve(self):
+        self.groups = {}
+        self.sounds = {}
+        first = 0
+        total = sum(self.group_sizes.values())
+        if pygame.mixer.get_num_channels() < total:
+            pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        for group, size in self.group_sizes.items():
+            self.groups[group] = [pygame.mixer.Channel(i) for i in range(first, first + size)]
+            first += size
+
+    def load(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            sound = assets.load_sound(SOUNDS[name][0])
+            self.sounds[name] = sound
+        return sound
+
+    def play(self, name):
+        if name in self.frame_played:
+            self.culled += 1
+            return None
+        if self.groups is None:
+            self.reserve()
+        path, group, voices = SOUNDS[name]
+        sound = self.load(name)
+        idle = None
+        for channel in self.groups[group]:
+            if channel.get_busy():
+                if channel.get_sound() is sound:
+                    voices -= 1
+            elif idle is None:
+                idle = channel
+        if idle is None or voices <= 0:
+            self.culled += 1
+            return None
+        self.frame_played.add(name)
+        self.played += 1
+        idle.play(sound)
+        return idle
+
+    def end_frame(self):
+        self.frame_played.clear()
+        now = time.perf_counter()
+        if self.second_start is None:
+            self.second_start = now
+        elif now - self.second_start >= 1:
+            elapsed = now - self.second_start
+            self.played_per_second = (self.played - self.second_played) / elapsed
+            self.culled_per_second = (self.culled - self.second_culled) / elapsed
+            self.second_start = now
+            self.second_played = self.played
+            self.second_culled = self.culled
+
+    def stats(self):
+        return {'played': self.played, 'culled': self.culled,
+                'played_per_second': self.played_per_second, 'culled_per_second': self.culled_per_second}
+
+class Coin(object):
+    __slots__ = ('rect', 'game_map', 'area', 'action', 'animation_start', 'animations', 'collected')
+
+    def __init__(self, game_map):
         self.rect = pygame.Rect((0, 0, 8, 8))
+        self.game_map = game_map
+        # New positions are drawn from the map regions this rect overlaps
+        self.area = pygame.Rect((0, 0), DISPLAY_SIZE)
         self.action = 'spin'
-        self.frame = 0
-        self.animation_frames = {}
-        self.animation_db = {}
+        self.animation_start = world_clock.now
+        self.animations = {}
         self.load_animations_db()
+        self.collected = 0
         self.generate_pos()
-        #SFX
-        self.pickup_sfx = pygame.mixer.Sound('assets/sfx/sounds/pickup.ogg')
 
-    def render(self, display):
-        self.frame += 1
-        if self.frame >= len(self.animation_db[self.action]):
-            self.frame = 0
-        img_id = self.animation_db[self.action][self.frame]
-        img = self.animation_frames[img_id]
-        display.blit(img, self.rect)
+    def render(self, display, offset = (0, 0)):
+        img = self.animations[self.action].image(world_clock.now - self.animation_start)
+        display.blit(img, (self.rect.x - offset[0], self.rect.y - offset[1]))
         
     def load_animation(self, path, duration):
-       animation_name = path.split('/')[-1]
-       animation_frame_data = []
-       n = 0
-       for frame in duration:
-           animation_frame_id = animation_name + '_' + str(n)
-           img_location = path + '/' + animation_frame_id + '.png'
-           animation_image = pygame.image.load(img_location).convert()
-           animation_image.set_colorkey((255, 0, 255))
-           self.animation_frames[animation_frame_id] = animation_image.copy()
-           for i in range(frame):
-               animation_frame_data.append(animation_frame_id)
-           n += 1
-       return animation_frame_data
+        return assets.load_animation(path, duration, (255, 0, 255))
 
     def load_animations_db(self):
-        self.animation_db['spin'] = self.load_animation('assets/graphics/coin/spin', [6, 6, 6, 6])
+        self.animations['spin'] = self.load_animation('assets/graphics/coin/spin', [6, 6, 6, 6])
 
     def generate_pos(self, play_sound = False):
         if play_sound:
-            self.pickup_sfx.play()
-        y_list = [4, 7, 10, 13]
-        y_selected = y_list[random.randrange(len(y_list))]
-        self.rect.y = 8 * y_selected
-
-        if y_selected == 7 or y_selected == 13:
-            if random.randrange(2) == 0:
-                self.rect.x = 8 * random.randint(1, 4)
-            else:
-                self.rect.x = 8 * random.randint(11, 14)
-        else:
-            self.rect.x = 8 * random.randint(4, 11)
+            sounds.play('pickup')
+        cell = self.game_map.random_standable(self.area)
+        if cell is not None:
+            self.rect.topleft = (cell[0] * self.game_map.tile_size, cell[1] * self.game_map.tile_size)
+
+    def snapshot(self):
+        return SNAPSHOT_COIN.pack(self.rect.x, self.rect.y, self.collected, self.animation_start)
+
+    def restore(self, data, offset):
+        x, y, self.collected, self.animation_start = SNAPSHOT_COIN.unpack_from(data, offset)
+        self.rect.topleft = (x, y)
+        return offset + SNAPSHOT_COIN.size
+
+# -- Enemies
+# One entry per enemy type; missing keys come from ENEMY_DEFAULTS
+ENEMY_DEFAULTS = {
+    'life': 3,
+    'angry_life': 5,
+    'speed': 1,
+    'jump': 5,
+    'colorkey': (255, 0, 255),
+    'animations': {'walk': [6, 6, 6], 'dead': [1], 'angry_walk': [6, 6, 6], 'angry_dead': [1]},
+}
+ENEMY_TYPES = {
+    'zombie': {'path': 'assets/graphics/enemies/zombie'},
+    'cricket': {'path': 'assets/graphics/enemies/cricket'},
+    'ghost': {'path': 'assets/graphics/enemies/ghost'},
+    'mud_demon': {'path': 'assets/graphics/enemies/mud_demon'},
+    'sand_demon': {'path': 'assets/graphics/enemies/sand_demon'},
+    'scissors_demon': {'path': 'assets/graphics/enemies/scissors_demon'},
+    'slug': {'path': 'assets/graphics/enemies/slug'},
+    'vampire': {'path': 'assets/graphics/enemies/vampire'},
+}
+
+class EnemyType(object):
+    # Shared, precomputed descriptor: every enemy of a type points at the same animation tables
+    def __init__(self, name, spec):
+        spec = dict(ENEMY_DEFAULTS, **spec)
+        self.name = name
+        self.path = spec['path']
+        self.life = spec['life']
+        self.angry_life = spec['angry_life']
+        self.speed = spec['speed']
+        self.jump = spec['jump']
+        self.colorkey = spec['colorkey']
+        self.durations = spec['animations']
+        self.actions = list(self.durations)
+        self.animations = {}
+        self.loaded = False
+
+    def manifest(self):
+        return [('animation', self.path + '/' + action, duration, self.colorkey) for action, duration in self.durations.items()]
+
+    def load(self):
+        for action, duration in self.durations.items():
+            self.animations[action] = assets.load_animation(self.path + '/' + action, duration, self.colorkey)
+        self.loaded = True
+
+enemy_types = {name: EnemyType(name, spec) for name, spec in ENEMY_TYPES.items()}
+
+class Enemy(object):
+    __slots__ = ('rect', 'velocity', 'disabled_timer', 'dead_timer', 'enemy_type', 'type', 'animations', 'last_pos',
+                 'life', 'dead', 'flip', 'grounded', 'heading', 'action', 'animation_start', 'angry', 'serial', 'slot')
 
-class BaseEnemy(object):
-    def __init__(self, x, y, angry):
-        self.type = 'Base'
+    def __init__(self, enemy_type, x, y, angry):
         self.rect = pygame.Rect(x, y, 8, 8)
-        self.life = 3 if not angry else 5
+        self.velocity = [0, 0]
+        self.disabled_timer = Timer(5, False, False)
+        self.dead_timer = Timer(8, False, False)
+        self.reset(enemy_type, x, y, angry)
+
+    def reset(self, enemy_type, x, y, angry):
+        if not enemy_type.loaded:
+            enemy_type.load()
+        self.enemy_type = enemy_type
+        self.type = enemy_type.name
+        self.animations = enemy_type.animations
+        self.rect.topleft = (x, y)
+        self.last_pos = (x, y)
+        self.life = enemy_type.life if not angry else enemy_type.angry_life
         self.dead = False
         self.flip = False
+        self.grounded = False
+        self.heading = 0
         self.action = 'walk' if not angry else 'angry_walk'
-        self.frame = 0
-        self.animation_frames = {}
-        self.animation_db = {}
-        self.load_animations_db()
-        self.disabled_timer = Timer(5, False, False)
-        self.dead_timer = Timer(8, False, False)
+        self.animation_start = world_clock.now
+        self.disabled_timer.reset()
+        self.dead_timer.reset()
         self.angry = angry
 
         rnd = random.randint(-1, 1)
         if rnd == 0:
             rnd += (1 if random.randint(0, 1) == 0 else -1)
-        self.velocity = [1 * rnd,0]
+        self.velocity[0] = enemy_type.speed * rnd
+        self.velocity[1] = 0
 
-        self.hurt_sfx = [pygame.mixer.Sound('assets/sfx/sounds/hurt_1.ogg'), pygame.mixer.Sound('assets/sfx/sounds/hurt_2.ogg')]
-
-    def render(self, display):
-        self.frame += 1
-        if self.frame >= len(self.animation_db[self.action]):
-            self.frame = 0
-        img_id = self.animation_db[self.action][self.frame]
-        
-        img = self.animation_frames[img_id]
+    def render(self, display, alpha = 1, offset = (0, 0)):
+        img = self.animations[self.action].image(world_clock.now - self.animation_start, self.flip)
+        x, y = interpolate(self, alpha)
         if self.disabled_timer.active:
             if self.disabled_timer.curr_tick % 2 == 0 and self.disabled_timer.curr_tick > 0:
-                display.blit(pygame.transform.flip(img, self.flip, False), self.rect)
+                display.blit(img, (x - offset[0], y - offset[1]))
         else:
-            display.blit(pygame.transform.flip(img, self.flip, False), self.rect)
+            display.blit(img, (x - offset[0], y - offset[1]))
 
-    def update(self, tiles):
+    def update(self, game_map):
         if not 'dead' in self.action:
             self.flip = self.velocity[0] < 0
             self.velocity[1] += GRAVITY
             if self.velocity[1] > 3:
                 self.velocity[1] = 3
 
-            self.rect, collisions = self.move(self.rect, self.velocity, tiles)
+            self.rect, collisions = self.move(self.rect, self.velocity, game_map)
             if collisions['top'] and self.velocity[1] < 0:
                 self.velocity[1] = 0
+            self.grounded = collisions['bottom']
             if collisions['bottom']:
                 if self.velocity[0] != 0:
                     if not self.angry:
-                        self.action, self.frame = self.change_action(self.action, self.frame, 'walk')
+                        self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'walk')
                     else:
-                        self.action, self.frame = self.change_action(self.action, self.frame, 'angry_walk')
+                        self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'angry_walk')
 
             if collisions['left'] or collisions['right']:
                 self.velocity[0] = -self.velocity[0]
-                        
-            self.disabled_timer.update()
-        self.dead_timer.update()
 
+        self.update_timers()
+
+    def snapshot(self, type_index):
+        return SNAPSHOT_ENEMY.pack(type_index, self.enemy_type.actions.index(self.action), self.rect.x, self.rect.y,
+            self.last_pos[0], self.last_pos[1], self.velocity[0], self.velocity[1], self.life, self.animation_start,
+            self.dead, self.flip, self.grounded, self.angry, self.heading, self.serial, *self.disabled_timer.state(),
+            *self.dead_timer.state())
+
+    def restore(self, enemy_type, record):
+        if not enemy_type.loaded:
+            enemy_type.load()
+        self.enemy_type = enemy_type
+        self.type = enemy_type.name
+        self.animations = enemy_type.animations
+        self.action = enemy_type.actions[record[1]]
+        self.rect.topleft = (record[2], record[3])
+        self.last_pos = (record[4], record[5])
+        self.velocity[0] = record[6]
+        self.velocity[1] = record[7]
+        self.life = record[8]
+        self.animation_start = record[9]
+        self.dead, self.flip, self.grounded, self.angry, self.heading, self.serial = record[10:16]
+        self.disabled_timer.set_state(*record[16:19])
+        self.dead_timer.set_state(*record[19:22])
+
+    def steer(self, navigator):
+        # Airborne cells have no move, so the heading of the link being followed is kept until landing
+        move = navigator.move(self.rect)
+        if move & NAV_LEFT:
+            self.heading = -1
+        elif move & NAV_RIGHT:
+            self.heading = 1
+        elif self.grounded:
+            self.heading = 0
+        if self.heading:
+            self.velocity[0] = abs(self.velocity[0]) * self.heading
+        if move & NAV_JUMP and self.grounded:
+            self.velocity[1] = -self.enemy_type.jump
+
+    def update_timers(self):
         if self.dead_timer.enabled:
             self.dead = True
         if self.dead_timer.active:
@@ -149,48 +752,26 @@ class BaseEnemy(object):
     
     def hurt(self):
         if not 'dead' in self.action:
-            self.hurt_sfx[random.randrange(2)].play()
+            sounds.play(('hurt_1', 'hurt_2')[random.randrange(2)])
         self.life -= 1
         if self.life <= 0:
-            self.dead_timer.active = True
+            self.dead_timer.start()
         else:
-            self.disabled_timer.active = True
-
-    def load_animation(self, path, duration):
-        animation_name = path.split('/')[-1]
-        animation_frame_data = []
-        n = 0
-        for frame in duration:
-            animation_frame_id = animation_name + '_' + str(n)
-            img_location = path + '/' + animation_frame_id + '.png'
-            animation_image = pygame.image.load(img_location).convert()
-            animation_image.set_colorkey((255, 0, 255))
-            self.animation_frames[animation_frame_id] = animation_image.copy()
-            for i in range(frame):
-                animation_frame_data.append(animation_frame_id)
-            n += 1
-        return animation_frame_data
+            self.disabled_timer.start()
 
-    def load_animations_db(self):
-        pass
-    
-    def change_action(self, curr_action, frame, new_action):
+    def change_action(self, curr_action, start, new_action):
         if curr_action != new_action:
             curr_action = new_action
-            frame = 0
-        return curr_action, frame
+            start = world_clock.now
+        return curr_action, start
 
-    def check_collision(self, rect, tiles):
-        hit_list = []
-        for tile in tiles:
-            if rect.colliderect(tile):
-                hit_list.append(tile)
-        return hit_list
+    def check_collision(self, rect, game_map):
+        return game_map.collide(rect)
     
-    def move(self, rect, velocity, tiles):
+    def move(self, rect, velocity, game_map):
         collision_types = {"top": False, "bottom": False, "right": False, "left": False}
         rect.x += velocity[0]
-        hit_list = self.check_collision(rect, tiles)
+        hit_list = self.check_collision(rect, game_map)
         for tile in hit_list:
             if velocity[0] > 0:
                 rect.right = tile.left
@@ -199,7 +780,7 @@ class BaseEnemy(object):
                 rect.left = tile.right
                 collision_types['left'] = True
         rect.y += velocity[1]
-        hit_list = self.check_collision(rect, tiles)
+        hit_list = self.check_collision(rect, game_map)
         for tile in hit_list:
             if velocity[1] > 0:
                 self.rect.bottom = tile.top
@@ -209,236 +790,790 @@ class BaseEnemy(object):
                 collision_types['top'] = True
         return rect, collision_types
 
-class Zombie(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'zombie'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/zombie/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/zombie/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/zombie/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/zombie/angry_dead', [1])
-
-class Cricket(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'cricket'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/cricket/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/cricket/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/cricket/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/cricket/angry_dead', [1])
-
-class Ghost(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'ghost'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/ghost/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/ghost/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/ghost/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/ghost/angry_dead', [1])
-
-class MudDemon(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'mud_demon'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/mud_demon/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/mud_demon/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/mud_demon/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/mud_demon/angry_dead', [1])
-
-class SandDemon(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'sand_demon'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/sand_demon/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/sand_demon/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/sand_demon/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/sand_demon/angry_dead', [1])
-
-class ScissorsDemon(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'scissors_demon'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/scissors_demon/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/scissors_demon/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/scissors_demon/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/scissors_demon/angry_dead', [1])
-
-class Slug(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'slug'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/slug/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/slug/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/slug/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/slug/angry_dead', [1])
-
-class Vampire(BaseEnemy):
-    def __init__(self, x, y, angry):
-        super().__init__(x, y, angry)
-        self.type = 'vampire'
-        
-    def load_animations_db(self):
-        self.animation_db['walk'] = self.load_animation('assets/graphics/enemies/vampire/walk', [6, 6, 6])
-        self.animation_db['dead'] = self.load_animation('assets/graphics/enemies/vampire/dead', [1])
-        self.animation_db['angry_walk'] = self.load_animation('assets/graphics/enemies/vampire/angry_walk', [6, 6, 6])
-        self.animation_db['angry_dead'] = self.load_animation('assets/graphics/enemies/vampire/angry_dead', [1])
+class EnemiesArrays(object):
+    # Struct-of-arrays copy of enemy physics state, stepped for all enemies at once
+    def __init__(self, capacity = 64):
+        self.fields = [('x', numpy.int64), ('y', numpy.int64), ('vx', numpy.int64), ('vy', numpy.float64),
+                       ('moving', bool), ('stepped', bool), ('asleep', bool), ('flip', bool), ('bottom', bool),
+                       ('jump', numpy.float64), ('heading', numpy.int64), ('serial', numpy.int64)]
+        self.capacity = 0
+        self.count = 0
+        self.free = []
+        self.solid = None
+        self.solid_map = None
+        self.solid_version = 0
+        self.rows = None
+        for name, dtype in self.fields:
+            setattr(self, name, numpy.zeros(0, dtype))
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        for name, dtype in self.fields:
+            array = numpy.zeros(capacity, dtype)
+            array[:self.capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def add(self, enemy):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow(self.capacity * 2)
+            slot = self.count
+            self.count += 1
+        enemy.slot = slot
+        self.load(enemy)
+
+    def load(self, enemy):
+        slot = enemy.slot
+        self.x[slot] = enemy.rect.x
+        self.y[slot] = enemy.rect.y
+        self.vx[slot] = enemy.velocity[0]
+        self.vy[slot] = enemy.velocity[1]
+        self.moving[slot] = not 'dead' in enemy.action
+        self.flip[slot] = enemy.flip
+        self.stepped[slot] = False
+        self.asleep[slot] = False
+        self.bottom[slot] = enemy.grounded
+        self.jump[slot] = enemy.enemy_type.jump
+        self.heading[slot] = enemy.heading
+        self.serial[slot] = enemy.serial
+
+    def store(self, enemy):
+        # The inverse of load: steering also changes enemies that sleep through the step
+        slot = enemy.slot
+        enemy.rect.topleft = (int(self.x[slot]), int(self.y[slot]))
+        enemy.velocity[0] = int(self.vx[slot])
+        enemy.velocity[1] = float(self.vy[slot])
+        enemy.flip = bool(self.flip[slot])
+        enemy.grounded = bool(self.bottom[slot])
+        enemy.heading = int(self.heading[slot])
+
+    def remove(self, enemy):
+        self.moving[enemy.slot] = False
+        self.free.append(enemy.slot)
+
+    def solid_cells(self, game_map):
+        if self.solid_map is not game_map or self.solid_version != game_map.version:
+            self.solid = numpy.frombuffer(game_map.data, numpy.uint8).reshape(game_map.height, game_map.width) != 0
+            self.solid_map = game_map
+            self.solid_version = game_map.version
+        return self.solid
+
+    def overlaps(self, solid, x, y, size):
+        # Mirrors Map.collide for size x size rects: returns the cell of the last hit
+        h, w = solid.shape
+        x0 = x // size
+        x1 = (x + size - 1) // size
+        y0 = y // size
+        y1 = (y + size - 1) // size
+
+        def cell(cy, cx):
+            inside = (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+            return inside & solid[numpy.clip(cy, 0, h - 1), numpy.clip(cx, 0, w - 1)]
+        h00, h01, h10, h11 = cell(y0, x0), cell(y0, x1), cell(y1, x0), cell(y1, x1)
+        hit = h00 | h01 | h10 | h11
+        hit_x = numpy.where(h11, x1, numpy.where(h10, x0, numpy.where(h01, x1, x0)))
+        hit_y = numpy.where(h11 | h10, y1, y0)
+        return hit, hit_x, hit_y
+
+    def awake(self, active, phase, interval):
+        # Inside the active rect, or this enemy's turn on the off-screen tier
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        inside = (x + 8 > active.left) & (x < active.right) & (y + 8 > active.top) & (y < active.bottom)
+        return inside | ((self.serial[:n] + phase) % interval == 0)
+
+    def steer(self, navigator):
+        n = self.count
+        m = self.moving[:n]
+        move = navigator.moves(self.x[:n], self.y[:n])
+        heading = self.heading[:n]
+        heading = numpy.where(move & NAV_LEFT != 0, -1, numpy.where(move & NAV_RIGHT != 0, 1,
+            numpy.where(self.bottom[:n], 0, heading)))
+        self.heading[:n] = numpy.where(m, heading, self.heading[:n])
+        vx = self.vx[:n]
+        self.vx[:n] = numpy.where(m & (heading != 0), abs(vx) * heading, vx)
+        jump = m & (move & NAV_JUMP != 0) & self.bottom[:n]
+        self.vy[:n] = numpy.where(jump, -self.jump[:n], self.vy[:n])
+
+    def update(self, game_map, awake = None):
+        n = self.count
+        m = self.moving[:n]
+        if awake is not None:
+            self.asleep[:n] = m & ~awake
+            m = m & awake
+        else:
+            self.asleep[:n] = False
+        self.stepped[:n] = m
+        if not m.any():
+            self.rows = None
+            return
+        solid = self.solid_cells(game_map)
+        size = game_map.tile_size
+        x, y, vx, vy = self.x[:n][m], self.y[:n][m], self.vx[:n][m], self.vy[:n][m]
+
+        self.flip[:n][m] = vx < 0
+        vy = numpy.minimum(vy + GRAVITY, 3)
+
+        x = x + vx
+        hit, hit_x, hit_y = self.overlaps(solid, x, y, size)
+        x = numpy.where(hit & (vx > 0), hit_x * size - size, x)
+        x = numpy.where(hit & (vx < 0), (hit_x + 1) * size, x)
+        vx = numpy.where(hit & (vx != 0), -vx, vx)
+
+        # pygame.Rect rounds half away from zero when assigned a float
+        y = y + vy
+        y = numpy.trunc(y + numpy.copysign(0.5, y)).astype(numpy.int64)
+        hit, hit_x, hit_y = self.overlaps(solid, x, y, size)
+        bottom = hit & (vy > 0)
+        top = hit & (vy < 0)
+        y = numpy.where(bottom, hit_y * size - size, y)
+        y = numpy.where(top, (hit_y + 1) * size, y)
+        vy = numpy.where(top, 0, vy)
+
+        self.x[:n][m] = x
+        self.y[:n][m] = y
+        self.vx[:n][m] = vx
+        self.vy[:n][m] = vy
+        self.bottom[:n][m] = bottom
+        # Plain lists are much cheaper to index per enemy than numpy scalars
+        self.rows = (self.x[:n].tolist(), self.y[:n].tolist(), self.vx[:n].tolist(), self.vy[:n].tolist(),
+                     self.flip[:n].tolist(), self.bottom[:n].tolist(), self.heading[:n].tolist())
+
+    def sync(self, enemy, game_map):
+        slot = enemy.slot
+        if self.asleep[slot]:
+            return
+        if self.moving[slot] and not self.stepped[slot]:
+            # Spawned after this tick's batch step
+            enemy.update(game_map)
+            self.load(enemy)
+            return
+        if self.moving[slot]:
+            x, y, vx, vy, flip, bottom, heading = self.rows
+            enemy.rect.x = x[slot]
+            enemy.rect.y = y[slot]
+            enemy.velocity[0] = vx[slot]
+            enemy.velocity[1] = vy[slot]
+            enemy.flip = flip[slot]
+            enemy.grounded = bottom[slot]
+            enemy.heading = heading[slot]
+            if bottom[slot] and enemy.velocity[0] != 0:
+                if not enemy.angry:
+                    enemy.action, enemy.animation_start = enemy.change_action(enemy.action, enemy.animation_start, 'walk')
+                else:
+                    enemy.action, enemy.animation_start = enemy.change_action(enemy.action, enemy.animation_start, 'angry_walk')
+        enemy.update_timers()
+        self.moving[slot] = not 'dead' in enemy.action
 
 class EnemiesManager(object):
-    def __init__(self):
-        self.enemies = []
+    def __init__(self, vectorized = VECTORIZED_ENEMIES):
+        self.pool = EntityPool()
+        self.enemies = self.pool.live
         self.spawn_timer = Timer(random.randint(60,80), True, True)
+        self.enemy_names = list(enemy_types)
+        self.enemy_index = {name: i for i, name in enumerate(self.enemy_names)}
+        self.arrays = EnemiesArrays() if vectorized and numpy is not None else None
+        self.grid = SpatialHash()
+        self.grid_dirty = True
+        # Spawns stand on a random cell of spawn_map near the active area; spawn_point is the fallback
+        self.spawn_map = None
+        self.spawn_point = (8*8, -8)
+        self.active = None
+        self.offscreen_interval = OFFSCREEN_INTERVAL
+        self.phase = 0
+        self.spawned = 0
+        self.navigator = None
 
-    def render(self, display):
+    def add_enemy(self, name, x, y, angry):
+        enemy = self.pool.spawn(Enemy, enemy_types[name], x, y, angry)
+        # The off-screen tier is keyed by spawn order, which survives pooling and snapshots
+        enemy.serial = self.spawned
+        self.spawned += 1
+        if self.arrays is not None:
+            self.arrays.add(enemy)
+        self.grid_dirty = True
+
+    def collide(self, rect):
+        # Enemies only move or spawn in update/add_enemy, so the grid is rebuilt lazily after them
+        if self.grid_dirty:
+            self.grid.clear()
+            for enemy in self.enemies:
+                self.grid.insert(enemy)
+            self.grid_dirty = False
+        return self.grid.collide(rect)
+
+    def release_enemy(self, enemy):
+        if self.arrays is not None:
+            self.arrays.remove(enemy)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def snapshot(self):
+        if self.arrays is not None:
+            for enemy in self.enemies:
+                if self.arrays.moving[enemy.slot]:
+                    self.arrays.store(enemy)
+        records = [enemy.snapshot(self.enemy_index[enemy.type]) for enemy in self.enemies]
+        return SNAPSHOT_ENEMIES.pack(self.phase, self.spawned, len(records), *self.spawn_timer.state()) + b''.join(records)
+
+    def restore(self, data, offset):
+        self.phase, self.spawned, count, ticks, deadline, fired = SNAPSHOT_ENEMIES.unpack_from(data, offset)
+        offset += SNAPSHOT_ENEMIES.size
+        self.spawn_timer.set_state(ticks, deadline, fired)
+        for enemy in self.enemies:
+            enemy.dead = True
+        self.pool.compact(self.release_enemy)
+        end = offset + count * SNAPSHOT_ENEMY.size
+        for record in SNAPSHOT_ENEMY.iter_unpack(data[offset:end]):
+            enemy_type = enemy_types[self.enemy_names[record[0]]]
+            enemy = self.pool.recycle(Enemy)
+            if enemy is None:
+                enemy = self.pool.spawn(Enemy, enemy_type, record[2], record[3], record[13])
+            enemy.restore(enemy_type, record)
+            if self.arrays is not None:
+                self.arrays.add(enemy)
+        self.grid_dirty = True
+        return end
+
+    def render(self, display, alpha = 1, offset = (0, 0), cull = None):
         for enemy in self.enemies:
-            if not enemy.dead:
-                enemy.render(display)
+            if not enemy.dead and (cull is None or cull.colliderect(enemy.rect)):
+                enemy.render(display, alpha, offset)
 
-    def update(self, tiles):
-        self.spawn_timer.update()
+    def update(self, game_map):
+        # Timer ticks count enemy updates, as the polled timers did
+        timers.advance()
         if self.spawn_timer.enabled:
             self.new_enemy()
-            self.spawn_timer.ticks = random.randint(60, 120)
+            self.spawn_timer.restart(random.randint(*SPAWN_INTERVAL))
 
-        for enemy in self.enemies:
-            if enemy.rect.top >= 128:
-                match enemy.type:
-                    case 'zombie':
-                        self.enemies.append(Zombie(8*8,-8,True))
-                    case 'cricket':
-                        self.enemies.append(Cricket(8*8,-8,True))
-                    case 'ghost':
-                        self.enemies.append(Ghost(8*8,-8,True))
-                    case 'mud_demon':
-                        self.enemies.append(MudDemon(8*8,-8,True))
-                    case 'sand_demon':
-                        self.enemies.append(SandDemon(8*8,-8,True))
-                    case 'scissors_demon':
-                        self.enemies.append(ScissorsDemon(8*8,-8,True))
-                    case 'slug':
-                        self.enemies.append(Slug(8*8,-8,True))
-                    case 'vampire':
-                        self.enemies.append(Vampire(8*8,-8,True))
-                self.enemies.remove(enemy)
+        # Off-screen enemies take turns, so each one updates every offscreen_interval calls
+        active = self.active
+        self.phase = (self.phase + 1) % self.offscreen_interval
+        # Steering happens before anything moves, so enemies spawned in the loop wait a tick
+        if self.navigator is not None:
+            if self.arrays is not None:
+                self.arrays.steer(self.navigator)
             else:
-                if not enemy.dead: 
-                    enemy.update(tiles)
-                else:
-                    self.enemies.remove(enemy)
+                for enemy in self.enemies:
+                    if not enemy.dead and not 'dead' in enemy.action:
+                        enemy.steer(self.navigator)
+        if self.arrays is not None:
+            awake = None
+            if active is not None:
+                awake = self.arrays.awake(active, self.phase, self.offscreen_interval)
+            self.arrays.update(game_map, awake)
+        # Enemies spawned inside the loop are appended and visited this tick, as before
+        for enemy in self.enemies:
+            if enemy.dead:
+                continue
+            if enemy.rect.top >= game_map.rect.bottom:
+                x, y = self.spawn_position()
+                self.add_enemy(enemy.type, x, y, True)
+                enemy.dead = True
+            elif self.arrays is not None:
+                if not self.arrays.asleep[enemy.slot]:
+                    enemy.last_pos = enemy.rect.topleft
+                self.arrays.sync(enemy, game_map)
+            elif active is None or (enemy.serial + self.phase) % self.offscreen_interval == 0 or active.colliderect(enemy.rect):
+                enemy.last_pos = enemy.rect.topleft
+                enemy.update(game_map)
+        self.pool.compact(self.release_enemy)
+        self.grid_dirty = True
+
+    def spawn_position(self):
+        if self.spawn_map is not None:
+            cell = self.spawn_map.random_standable(self.active)
+            if cell is not None:
+                return cell[0] * self.spawn_map.tile_size, cell[1] * self.spawn_map.tile_size
+        return self.spawn_point
 
     def new_enemy(self):
-        match random.randint(0,7):
-            case 0:
-                self.enemies.append(Zombie(8*8,-8, False))
-            case 1:
-                self.enemies.append(Cricket(8*8,-8, False))
-            case 2:
-                self.enemies.append(Ghost(8*8,-8, False))
-            case 3:
-                self.enemies.append(MudDemon(8*8,-8, False))
-            case 4:
-                self.enemies.append(SandDemon(8*8,-8, False))
-            case 5:
-                self.enemies.append(ScissorsDemon(8*8,-8, False))
-            case 6:
-                self.enemies.append(Slug(8*8,-8, False))
-            case 7:
-                self.enemies.append(Vampire(8*8,-8, False))
+        name = self.enemy_names[random.randint(0, len(self.enemy_names) - 1)]
+        x, y = self.spawn_position()
+        self.add_enemy(name, x, y, False)
 
 class Shuriken(object):
+    __slots__ = ('img', 'rect', 'last_pos', 'vx', 'dead')
+
     def __init__(self, x, y, direction):
-        self.img = pygame.image.load('assets/graphics/weapons/shuriken.png')
-        self.img.set_colorkey((255, 0, 0))
+        self.img = assets.load_image('assets/graphics/weapons/shuriken.png', (255, 0, 0))
         self.rect = pygame.Rect(x, y, self.img.get_width(), self.img.get_height())
+        self.reset(x, y, direction)
+
+    def reset(self, x, y, direction):
+        self.rect.topleft = (x, y)
+        self.last_pos = (x, y)
         self.vx = 5 * (-1 if direction else 1)
         self.dead = False
-        #SFX
-        self.crash_sfx = pygame.mixer.Sound('assets/sfx/sounds/crash.ogg')
 
-    def update(self, tiles, enemies):
+    def update(self, game_map, enemies_manager):
+        self.last_pos = self.rect.topleft
         self.rect.centerx += self.vx
 
-        for tile in tiles:
-            if self.rect.colliderect(tile):
-                self.crash_sfx.play()
-                self.dead = True
+        if game_map.collide(self.rect):
+            sounds.play('crash')
+            self.dead = True
+        elif not game_map.rect.colliderect(self.rect):
+            self.dead = True
 
-        for enemy in enemies:
-            if self.rect.colliderect(enemy.rect):
-                if not enemy.disabled_timer.active:
-                  enemy.hurt()
-                self.dead = True
+        for enemy in enemies_manager.collide(self.rect):
+            if not enemy.disabled_timer.active:
+              enemy.hurt()
+            self.dead = True
         
-    def render(self, display):
-        display.blit(self.img, (self.rect.x, self.rect.y))
+    def render(self, display, alpha = 1, offset = (0, 0)):
+        x, y = interpolate(self, alpha)
+        display.blit(self.img, (x - offset[0], y - offset[1]))
+
+    def snapshot(self):
+        return SNAPSHOT_SHURIKEN.pack(self.rect.x, self.rect.y, self.last_pos[0], self.last_pos[1], self.vx)
 
 class ProjectilesManager(object):
     def __init__(self):
-        self.projectiles = []
+        self.pool = EntityPool()
+        self.projectiles = self.pool.live
+
+    def spawn(self, x, y, direction):
+        return self.pool.spawn(Shuriken, x, y, direction)
 
-    def update(self, tiles, enemies):
+    def update(self, game_map, enemies_manager):
         for projectile in self.projectiles:
             if not projectile.dead:
-                projectile.update(tiles, enemies)
-            else:
-                self.projectiles.remove(projectile)
+                projectile.update(game_map, enemies_manager)
+        self.pool.compact()
 
-    def render(self, display):
+    def stats(self):
+        return self.pool.stats()
+
+    def snapshot(self):
+        return SNAPSHOT_COUNT.pack(len(self.projectiles)) + b''.join([projectile.snapshot() for projectile in self.projectiles])
+
+    def restore(self, data, offset):
+        count, = SNAPSHOT_COUNT.unpack_from(data, offset)
+        offset += SNAPSHOT_COUNT.size
         for projectile in self.projectiles:
-            if not projectile.dead:
-                projectile.render(display)
+            projectile.dead = True
+        self.pool.compact()
+        end = offset + count * SNAPSHOT_SHURIKEN.size
+        for x, y, last_x, last_y, vx in SNAPSHOT_SHURIKEN.iter_unpack(data[offset:end]):
+            projectile = self.spawn(x, y, vx < 0)
+            projectile.last_pos = (last_x, last_y)
+            projectile.vx = vx
+        return end
+
+    def render(self, display, alpha = 1, offset = (0, 0), cull = None):
+        for projectile in self.projectiles:
+            if not projectile.dead and (cull is None or cull.colliderect(projectile.rect)):
+                projectile.render(display, alpha, offset)
         
+# -- Levels
+# Binary level: header (magic, version, flags, width, height) then one byte per tile,
+# row-major, or (count, tile) runs when the RLE flag is set
+LEVEL_MAGIC = b'PWLV'
+LEVEL_VERSION = 1
+LEVEL_RLE = 1
+LEVEL_HEADER = struct.Struct('<4sBBII')
+LEVEL_RUN = struct.Struct('<HB')
+
+def read_text_level(path):
+    with open(path, 'r') as file:
+        rows = [row.strip('\r') for row in file.read().split('\n')]
+    while rows and rows[-1] == '':
+        rows.pop()
+    width = max([len(row) for row in rows] + [0])
+    height = len(rows)
+    data = bytearray(width * height)
+    table = bytes.maketrans(b'0123456789', bytes(range(10)))
+    for y in range(height):
+        row = rows[y].encode('ascii').translate(table)
+        data[y * width:y * width + len(row)] = row
+    return width, height, data
+
+def read_level(path):
+    with open(path, 'rb') as file:
+        header = file.read(LEVEL_HEADER.size)
+        magic, version, flags, width, height = LEVEL_HEADER.unpack(header)
+        if magic != LEVEL_MAGIC or version > LEVEL_VERSION:
+            raise ValueError(path + ' is not a level file')
+        if flags & LEVEL_RLE:
+            runs = file.read()
+            if numpy is not None:
+                pairs = numpy.frombuffer(runs, numpy.dtype([('count', '<u2'), ('tile', 'u1')]))
+                return width, height, bytearray(numpy.repeat(pairs['tile'], pairs['count']).tobytes())
+            data = bytearray()
+            for count, tile in LEVEL_RUN.iter_unpack(runs):
+                data += bytes((tile,)) * count
+            return width, height, data
+        if width * height == 0:
+            return width, height, bytearray()
+        # Copy-on-write mapping: pages are only read in when touched and edits stay private
+        level_mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY)
+        return width, height, memoryview(level_mmap)[LEVEL_HEADER.size:LEVEL_HEADER.size + width * height]
+
+def write_level(path, width, height, data, rle = False):
+    with open(path, 'wb') as file:
+        file.write(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, LEVEL_RLE if rle else 0, width, height))
+        if not rle:
+            file.write(bytes(data))
+            return
+        runs = bytearray()
+        i = 0
+        while i < len(data):
+            count = 1
+            while i + count < len(data) and data[i + count] == data[i] and count < 0xffff:
+                count += 1
+            runs += LEVEL_RUN.pack(count, data[i])
+            i += count
+        file.write(runs)
+
 class Map(object):
-    def __init__(self):
+    def __init__(self, path = 'level'):
         self.tile_size = 8
+        self.chunk_size = 16
+        self.data = bytearray()
         self.game_map = []
-        self.tile_rects = []
-        self.load_map('level')
-        self.calculate_rects()
-        self.img = pygame.image.load('assets/graphics/tiles/tile_1.png')
-       
+        self.tile_rects = {}
+        self.chunks = {}
+        self.version = 0
+        self.width = 0
+        self.height = 0
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        # Standable cells (free, with a solid cell below) per chunk-sized region, indexed on first draw,
+        # and as one (cells, index) pair built on the first whole-map draw
+        self.regions = {}
+        self.standable = None
+        self.render_time = 0
+        self.render_count = 0
+        self.load_map(path)
+        self.img = assets.load_image('assets/graphics/tiles/tile_1.png')
+
     def load_map(self, path):
-        f = open(path + '.dat', 'r')
-        data = f.read()
-        f.close()
-        data = data.split('\n')
-        for row in data:
-            self.game_map.append(list(row))
+        # 'level' loads the text level.dat, 'level.lvl' the binary format
+        if path.endswith('.lvl'):
+            self.width, self.height, self.data = read_level(path)
+        else:
+            self.width, self.height, self.data = read_text_level(path + '.dat')
+        self.set_level(self.width, self.height, self.data)
+
+    def set_level(self, width, height, data):
+        self.width = width
+        self.height = height
+        self.data = data
+        # Rows are views into one buffer, so a cell is a plain int and costs no object
+        view = memoryview(data)
+        self.game_map = [view[y * width:(y + 1) * width] for y in range(height)]
+        self.rect = pygame.Rect(0, 0, width * self.tile_size, height * self.tile_size)
+        self.tile_rects = {}
+        self.chunks = {}
+        self.regions = {}
+        self.standable = None
+        self.version += 1
+
+    def save_map(self, path, rle = False):
+        write_level(path, self.width, self.height, self.data, rle)
+
+    def restore(self, width, height, data):
+        # Tiles are written in place, so the row views stay valid; an unchanged map keeps every cache
+        if (width, height) != (self.width, self.height):
+            self.set_level(width, height, bytearray(data))
+            return
+        if self.data == data:
+            return
+        self.data[:] = data
+        self.regions = {}
+        self.standable = None
+        self.chunks.clear()
+        self.version += 1
+
+    def render(self, display, offset = (0, 0)):
+        start = time.perf_counter()
+        chunk_px = self.chunk_size * self.tile_size
+        view = pygame.Rect(offset, display.get_size())
+        cx0 = max(view.left // chunk_px, 0)
+        cx1 = min((view.right - 1) // chunk_px, (self.width - 1) // self.chunk_size)
+        cy0 = max(view.top // chunk_px, 0)
+        cy1 = min((view.bottom - 1) // chunk_px, (self.height - 1) // self.chunk_size)
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    chunk = self.bake_chunk(cx, cy)
+                display.blit(chunk, (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))
+        self.render_time += time.perf_counter() - start
+        self.render_count += 1
+
+    def bake_chunk(self, cx, cy):
+        chunk_px = self.chunk_size * self.tile_size
+        chunk = pygame.Surface((chunk_px, chunk_px), pygame.SRCALPHA)
+        for y in range(cy * self.chunk_size, min((cy + 1) * self.chunk_size, self.height)):
+            row = self.game_map[y]
+            for x in range(cx * self.chunk_size, min((cx + 1) * self.chunk_size, self.width)):
+                if row[x] == 1:
+                    chunk.blit(self.img, ((x - cx * self.chunk_size) * self.tile_size, (y - cy * self.chunk_size) * self.tile_size))
+        self.chunks[(cx, cy)] = chunk
+        return chunk
+
+    def is_standable(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height - 1 and self.game_map[y][x] == 0 and self.game_map[y + 1][x] != 0
+
+    def standable_cells(self, x0 = 0, y0 = 0, x1 = None, y1 = None):
+        # Scans the tiles in [x0, x1) x [y0, y1) without touching the index
+        x1 = self.width if x1 is None else x1
+        y1 = min(self.height - 1 if y1 is None else y1, self.height - 1)
+        if x0 >= x1 or y0 >= y1:
+            return []
+        if numpy is not None:
+            cells = numpy.frombuffer(self.data, numpy.uint8).reshape(self.height, self.width)[y0:y1 + 1, x0:x1] != 0
+            ys, xs = numpy.nonzero(~cells[:-1] & cells[1:])
+            return list(zip((xs + x0).tolist(), (ys + y0).tolist()))
+        return [(x, y) for y in range(y0, y1) for x in range(x0, x1) if self.is_standable(x, y)]
+
+    def region(self, rx, ry):
+        region = self.regions.get((rx, ry))
+        if region is None:
+            size = self.chunk_size
+            cells = self.standable_cells(rx * size, ry * size, (rx + 1) * size, (ry + 1) * size)
+            region = self.regions[(rx, ry)] = (cells, {cell: i for i, cell in enumerate(cells)})
+        return region
+
+    def update_standable(self, x, y):
+        # Indexes not built yet are scanned from the tiles when first drawn from
+        if y < 0 or y >= self.height - 1:
+            return
+        standable = self.is_standable(x, y)
+        for pair in (self.regions.get((x // self.chunk_size, y // self.chunk_size)), self.standable):
+            if pair is None:
+                continue
+            cells, index = pair
+            cell = (x, y)
+            if standable:
+                if cell not in index:
+                    index[cell] = len(cells)
+                    cells.append(cell)
+            elif cell in index:
+                # Swap with the last entry so removal stays O(1)
+                i = index.pop(cell)
+                last = cells.pop()
+                if last != cell:
+                    cells[i] = last
+                    index[last] = i
+
+    def random_standable(self, area = None):
+        # A cell whose whole tile lies inside area, or anywhere on the map when area is None
+        if area is None:
+            if self.standable is None:
+                cells = self.standable_cells()
+                self.standable = (cells, {cell: i for i, cell in enumerate(cells)})
+            cells = self.standable[0]
+            return cells[random.randrange(len(cells))] if cells else None
+        size = self.tile_size
+        x0 = max(-(-area.left // size), 0)
+        y0 = max(-(-area.top // size), 0)
+        x1 = min(area.right // size, self.width)
+        y1 = min(area.bottom // size, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        groups = []
+        total = 0
+        for ry in range(y0 // self.chunk_size, (y1 - 1) // self.chunk_size + 1):
+            for rx in range(x0 // self.chunk_size, (x1 - 1) // self.chunk_size + 1):
+                cells = self.region(rx, ry)[0]
+                if cells:
+                    groups.append(cells)
+                    total += len(cells)
+        if total == 0:
+            return None
+        # Draw from the regions the area overlaps until a cell falls inside it
+        for tries in range(32):
+            n = random.randrange(total)
+            for cells in groups:
+                if n < len(cells):
+                    cell = cells[n]
+                    break
+                n -= len(cells)
+            if x0 <= cell[0] < x1 and y0 <= cell[1] < y1:
+                return cell
+        # Almost nothing inside the area: draw from an exact list instead
+        cells = [cell for cells in groups for cell in cells if x0 <= cell[0] < x1 and y0 <= cell[1] < y1]
+        return cells[random.randrange(len(cells))] if cells else None
+
+    def set_tile(self, x, y, tile):
+        self.game_map[y][x] = tile
+        self.update_standable(x, y)
+        self.update_standable(x, y - 1)
+        self.tile_rects.pop((x, y), None)
+        # The baked chunk is rebuilt on its next render
+        self.chunks.pop((x // self.chunk_size, y // self.chunk_size), None)
+        self.version += 1
+
+    def average_render_time(self):
+        if self.render_count == 0:
+            return 0
+        return self.render_time / self.render_count
+
+    def tile_rect(self, x, y):
+        tile_rect = self.tile_rects.get((x, y))
+        if tile_rect is None:
+            tile_rect = pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+            self.tile_rects[(x, y)] = tile_rect
+        return tile_rect
 
-    def render(self, display):
-        y = 0
-        for row in self.game_map:
-            x = 0
-            for tile in row:
-                if tile == '1':
-                    display.blit(self.img, (x * self.tile_size, y * self.tile_size))
-                x += 1
-            y += 1
-    
     def calculate_rects(self):
-        y = 0
-        for row in self.game_map:
-            x = 0
-            for tile in row:
-                if tile != '0':
-                    self.tile_rects.append(pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size))
-                x += 1
-            y += 1
+        rects = []
+        for y in range(self.height):
+            row = self.game_map[y]
+            for x in range(self.width):
+                if row[x] != 0:
+                    rects.append(self.tile_rect(x, y))
+        return rects
+
+    def collide(self, rect):
+        # Only the grid cells covered by rect can hold a colliding tile
+        hit_list = []
+        x0 = max(rect.left // self.tile_size, 0)
+        x1 = min((rect.right - 1) // self.tile_size, self.width - 1)
+        y0 = max(rect.top // self.tile_size, 0)
+        y1 = min((rect.bottom - 1) // self.tile_size, self.height - 1)
+        for y in range(y0, y1 + 1):
+            row = self.game_map[y]
+            for x in range(x0, x1 + 1):
+                if row[x] != 0:
+                    hit_list.append(self.tile_rect(x, y))
+        return hit_list
+
+def jump_height(speed, gravity = None):
+    # Pixels risen by a jump, stepped like Enemy.update including pygame.Rect's rounding
+    if gravity is None:
+        gravity = GRAVITY
+    start = y = 1 << 16
+    vy = -speed
+    while vy + gravity < 0:
+        vy += gravity
+        y = int(y + vy + 0.5)
+    return start - y
+
+class Navigator(object):
+    # Walk, drop and jump links between standable cells, rebuilt when the map changes, and a
+    # BFS flow field over them toward the goal cell: field holds the NAV_* move out of each cell
+    def __init__(self, game_map, jump_cells = None):
+        self.game_map = game_map
+        # Jump links only go as high as the weakest jumper can reach
+        if jump_cells is None:
+            jump_cells = min([jump_height(enemy_type.jump) for enemy_type in enemy_types.values()]) // game_map.tile_size
+        self.jump_cells = jump_cells
+        self.incoming = {}
+        self.version = -1
+        self.goal = None
+        self.field = bytearray(game_map.width * game_map.height)
+        self.field_array = numpy.frombuffer(self.field, numpy.uint8) if numpy is not None else None
+        self.builds = 0
+        self.recomputes = 0
+
+    def free(self, x, y):
+        game_map = self.game_map
+        return 0 <= x < game_map.width and 0 <= y < game_map.height and game_map.game_map[y][x] == 0
+
+    def build(self):
+        is_standable = self.game_map.is_standable
+        if len(self.field) != self.game_map.width * self.game_map.height:
+            self.field = bytearray(self.game_map.width * self.game_map.height)
+            self.field_array = numpy.frombuffer(self.field, numpy.uint8) if numpy is not None else None
+        incoming = {}
+        for cell in self.game_map.standable_cells():
+            x, y = cell
+            for nx, move in ((x - 1, NAV_LEFT), (x + 1, NAV_RIGHT)):
+                target = None
+                if is_standable(nx, y):
+                    target = (nx, y)
+                elif self.free(nx, y):
+                    # Walk off the edge and fall down column nx to the first floor
+                    ny = y + 1
+                    while self.free(nx, ny) and not is_standable(nx, ny):
+                        ny += 1
+                    if is_standable(nx, ny):
+                        target = (nx, ny)
+                elif 0 <= nx < self.game_map.width:
+                    # A wall: jump onto the lowest ledge in reach with headroom above
+                    for k in range(1, self.jump_cells + 1):
+                        if not self.free(x, y - k):
+                            break
+                        if is_standable(nx, y - k):
+                            target = (nx, y - k)
+                            move |= NAV_JUMP
+                            break
+                if target is not None:
+                    links = incoming.get(target)
+                    if links is None:
+                        links = incoming[target] = []
+                    links.append((cell, move))
+        self.incoming = incoming
+        self.version = self.game_map.version
+        self.goal = None
+        self.builds += 1
+
+    def set_goal(self, rect):
+        # Recomputes only when the goal moves to another standable cell; airborne keeps the last one
+        if self.version != self.game_map.version:
+            self.build()
+        size = self.game_map.tile_size
+        cell = (rect.centerx // size, (rect.bottom - 1) // size)
+        if cell == self.goal or not self.game_map.is_standable(*cell):
+            return False
+        self.goal = cell
+        self.recompute()
+        return True
+
+    def restore(self, goal):
+        # The field for a saved goal, even when the player is airborne and set_goal would keep the old one
+        if self.version != self.game_map.version:
+            self.build()
+        self.goal = goal
+        if goal is None:
+            self.field[:] = bytes(len(self.field))
+        else:
+            self.recompute()
+
+    def recompute(self):
+        width = self.game_map.width
+        field = self.field
+        field[:] = bytes(len(field))
+        incoming = self.incoming
+        seen = {self.goal}
+        queue = collections.deque([self.goal])
+        while queue:
+            for source, move in incoming.get(queue.popleft(), ()):
+                if source not in seen:
+                    seen.add(source)
+                    field[source[1] * width + source[0]] = move
+                    queue.append(source)
+        self.recomputes += 1
+
+    def move(self, rect):
+        size = self.game_map.tile_size
+        x = rect.centerx // size
+        y = (rect.bottom - 1) // size
+        if 0 <= x < self.game_map.width and 0 <= y < self.game_map.height:
+            return self.field[y * self.game_map.width + x]
+        return 0
+
+    def moves(self, x, y):
+        # move() for arrays of 8x8 enemy positions
+        size = self.game_map.tile_size
+        width, height = self.game_map.width, self.game_map.height
+        cx = (x + 4) // size
+        cy = (y + 7) // size
+        inside = (cx >= 0) & (cx < width) & (cy >= 0) & (cy < height)
+        return numpy.where(inside, self.field_array[numpy.clip(cy, 0, height - 1) * width + numpy.clip(cx, 0, width - 1)], 0)
 
 class Player(object):
+    __slots__ = ('hspeed', 'jspeed', 'move_right', 'move_left', 'rect', 'last_pos', 'velocity', 'airtime', 'flip',
+                 'action', 'animation_start', 'animations', 'move_now')
+
     def __init__(self):
         self.hspeed = 1
         self.jspeed = 6
@@ -446,28 +1581,26 @@ class Player(object):
         self.move_left = False
         self.rect = pygame.Rect(DISPLAY_SIZE[0]//2, 0, 8, 8)
         self.rect.bottom = 8 * 12
+        self.last_pos = self.rect.topleft
         self.velocity = [0, 0]
         self.airtime = 0
         self.flip = False
         self.action = 'idle'
-        self.frame = 0
-        self.animation_frames = {}
-        self.animation_db = {}
+        self.animation_start = world_clock.now
+        self.animations = {}
         self.load_animations_db()
         self.move_now = 0
-        #SFX
-        self.jump_sfx = pygame.mixer.Sound('assets/sfx/sounds/jump.ogg')
-        self.throw_sfx = pygame.mixer.Sound('assets/sfx/sounds/throw.ogg')
         
-    def update(self, tiles, enemies, coin):
+    def update(self, game_map, enemies_manager, coin):
+        self.last_pos = self.rect.topleft
         if self.rect.colliderect(coin.rect):
+            coin.collected += 1
             coin.generate_pos(True)
-        for enemy in enemies:
-            if self.rect.colliderect(enemy.rect):
-                pass
-                #pygame.quit()
-                #sys.exit()
-                ##########
+        for enemy in enemies_manager.collide(self.rect):
+            pass
+            #pygame.quit()
+            #sys.exit()
+            ##########
         if self.rect.top <= 0:
             self.rect.top = 0
         
@@ -484,7 +1617,7 @@ class Player(object):
         if self.velocity[1] > 3:
             self.velocity[1] = 3
 
-        self.rect, collisions = self.move(self.rect, self.velocity, tiles)
+        self.rect, collisions = self.move(self.rect, self.velocity, game_map)
 
         if collisions['bottom']:
             self.airtime = 0
@@ -497,65 +1630,59 @@ class Player(object):
 
         if not collisions['bottom']:
             if self.velocity[1] > 0:
-                self.action, self.frame = self.change_action(self.action, self.frame, 'fall')
+                self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'fall')
             elif self.velocity[1] < 0:
-                self.action, self.frame = self.change_action(self.action, self.frame, 'jump')
+                self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'jump')
         else:
             if self.velocity[0] != 0:
-                self.action, self.frame = self.change_action(self.action, self.frame, 'run')
+                self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'run')
             else:
-                self.action, self.frame = self.change_action(self.action, self.frame, 'idle')
+                self.action, self.animation_start = self.change_action(self.action, self.animation_start, 'idle')
         
-    def render(self, display):
-        self.frame += 1
-        if self.frame >= len(self.animation_db[self.action]):
-            self.frame = 0
-        img_id = self.animation_db[self.action][self.frame]
-        img = self.animation_frames[img_id]
-        display.blit(pygame.transform.flip(img, self.flip, False), self.rect)
-
-    def shoot(self, projectiles):
-        self.throw_sfx.play()
-        projectiles.append(Shuriken(self.rect.centerx, self.rect.centery, self.flip))
+    def render(self, display, alpha = 1, offset = (0, 0)):
+        img = self.animations[self.action].image(world_clock.now - self.animation_start, self.flip)
+        x, y = interpolate(self, alpha)
+        display.blit(img, (x - offset[0], y - offset[1]))
+
+    def snapshot(self):
+        return SNAPSHOT_PLAYER.pack(self.rect.x, self.rect.y, self.last_pos[0], self.last_pos[1], self.velocity[0],
+            self.velocity[1], self.airtime, self.flip, list(self.animations).index(self.action), self.animation_start,
+            self.move_left, self.move_right)
+
+    def restore(self, data, offset):
+        (x, y, last_x, last_y, self.velocity[0], self.velocity[1], self.airtime, self.flip, action, self.animation_start,
+            self.move_left, self.move_right) = SNAPSHOT_PLAYER.unpack_from(data, offset)
+        self.rect.topleft = (x, y)
+        self.last_pos = (last_x, last_y)
+        self.action = list(self.animations)[action]
+        return offset + SNAPSHOT_PLAYER.size
+
+    def shoot(self, projectiles_manager):
+        sounds.play('throw')
+        projectiles_manager.spawn(self.rect.centerx, self.rect.centery, self.flip)
         
     def load_animation(self, path, duration):
-        animation_name = path.split('/')[-1]
-        animation_frame_data = []
-        n = 0
-        for frame in duration:
-            animation_frame_id = animation_name + '_' + str(n)
-            img_location = path + '/' + animation_frame_id + '.png'
-            animation_image = pygame.image.load(img_location).convert()
-            animation_image.set_colorkey((255, 255, 255))
-            self.animation_frames[animation_frame_id] = animation_image.copy()
-            for i in range(frame):
-                animation_frame_data.append(animation_frame_id)
-            n += 1
-        return animation_frame_data
+        return assets.load_animation(path, duration, (255, 255, 255))
 
     def load_animations_db(self):
-        self.animation_db['idle'] = self.load_animation('assets/graphics/player/animations/idle', [30, 30])
-        self.animation_db['run'] = self.load_animation('assets/graphics/player/animations/run', [8, 8, 8, 8])
-        self.animation_db['jump'] = self.load_animation('assets/graphics/player/animations/jump', [1])
-        self.animation_db['fall'] = self.load_animation('assets/graphics/player/animations/fall', [1])
+        self.animations['idle'] = self.load_animation('assets/graphics/player/animations/idle', [30, 30])
+        self.animations['run'] = self.load_animation('assets/graphics/player/animations/run', [8, 8, 8, 8])
+        self.animations['jump'] = self.load_animation('assets/graphics/player/animations/jump', [1])
+        self.animations['fall'] = self.load_animation('assets/graphics/player/animations/fall', [1])
     
-    def change_action(self, curr_action, frame, new_action):
+    def change_action(self, curr_action, start, new_action):
         if curr_action != new_action:
             curr_action = new_action
-            frame = 0
-        return curr_action, frame
+            start = world_clock.now
+        return curr_action, start
     
-    def check_collision(self, rect, tiles):
-        hit_list = []
-        for tile in tiles:
-            if rect.colliderect(tile):
-                hit_list.append(tile)
-        return hit_list
+    def check_collision(self, rect, game_map):
+        return game_map.collide(rect)
     
-    def move(self, rect, velocity, tiles):
+    def move(self, rect, velocity, game_map):
         collision_types = {"top": False, "bottom": False, "right": False, "left": False}
         rect.x += velocity[0]
-        hit_list = self.check_collision(rect, tiles)
+        hit_list = self.check_collision(rect, game_map)
         for tile in hit_list:
             if velocity[0] > 0:
                 rect.right = tile.left
@@ -564,7 +1691,7 @@ class Player(object):
                 rect.left = tile.right
                 collision_types['left'] = True
         rect.y += velocity[1]
-        hit_list = self.check_collision(rect, tiles)
+        hit_list = self.check_collision(rect, game_map)
         for tile in hit_list:
             if velocity[1] > 0:
                 self.rect.bottom = tile.top
@@ -574,58 +1701,592 @@ class Player(object):
                 collision_types['top'] = True
         return rect, collision_types
     
+# -- Assets
+ASSETS_MANIFEST = [
+    ('animation', 'assets/graphics/coin/spin', [6, 6, 6, 6], (255, 0, 255)),
+    ('animation', 'assets/graphics/player/animations/idle', [30, 30], (255, 255, 255)),
+    ('animation', 'assets/graphics/player/animations/run', [8, 8, 8, 8], (255, 255, 255)),
+    ('animation', 'assets/graphics/player/animations/jump', [1], (255, 255, 255)),
+    ('animation', 'assets/graphics/player/animations/fall', [1], (255, 255, 255)),
+    ('image', 'assets/graphics/weapons/shuriken.png', (255, 0, 0)),
+    ('image', 'assets/graphics/tiles/tile_1.png'),
+    ('sound', 'assets/sfx/sounds/pickup.ogg'),
+    ('sound', 'assets/sfx/sounds/hurt_1.ogg'),
+    ('sound', 'assets/sfx/sounds/hurt_2.ogg'),
+    ('sound', 'assets/sfx/sounds/crash.ogg'),
+    ('sound', 'assets/sfx/sounds/jump.ogg'),
+    ('sound', 'assets/sfx/sounds/throw.ogg'),
+]
+for enemy_type in enemy_types.values():
+    ASSETS_MANIFEST.extend(enemy_type.manifest())
+
+assets = AssetsManager()
+sounds = SoundsManager()
+timers = TimerWheel()
+world_clock = Clock()
+
+# -- Profiling
+PROFILER_COLORS = [(255, 99, 71), (255, 215, 0), (50, 205, 50), (30, 144, 255), (238, 130, 238),
+                   (255, 165, 0), (0, 206, 209), (218, 112, 214), (240, 240, 240)]
+
+class FrameProfiler(object):
+    # Ring buffer of the last N frames, each a list of (phase, start, duration) in seconds
+    def __init__(self, size = PROFILER_FRAMES):
+        self.frames = collections.deque(maxlen = size)
+        self.phases = []
+        self.current = []
+        self.frame_start = 0
+        self.visible = False
+
+    def begin_frame(self):
+        self.current = []
+        self.frame_start = time.perf_counter()
+        return self.frame_start
+
+    def mark(self, name, start):
+        now = time.perf_counter()
+        self.current.append((name, start, now - start))
+        return now
+
+    def end_frame(self):
+        for name, start, duration in self.current:
+            if not name in self.phases:
+                self.phases.append(name)
+        self.frames.append((self.frame_start, self.current))
+
+    def averages(self):
+        totals = dict.fromkeys(self.phases, 0)
+        for frame_start, phases in self.frames:
+            for name, start, duration in phases:
+                totals[name] += duration
+        return {name: total / max(len(self.frames), 1) for name, total in totals.items()}
+
+    def render(self, display):
+        # Stacked bar per frame, newest on the right; the line marks the frame budget
+        w, h = display.get_size()
+        graph = pygame.Rect(0, h - 32, w, 32)
+        scale = 24 / FRAME_BUDGET
+        display.fill((0, 0, 0), graph)
+        frames = list(self.frames)[-w:]
+        x = w - len(frames)
+        for frame_start, phases in frames:
+            y = graph.bottom
+            for name, start, duration in phases:
+                bar = max(int(duration * scale), 0)
+                if bar:
+                    display.fill(PROFILER_COLORS[self.phases.index(name) % len(PROFILER_COLORS)], (x, y - bar, 1, bar))
+                    y -= bar
+                if y <= graph.top:
+                    break
+            x += 1
+        display.fill((255, 255, 255), (0, graph.bottom - 24, w, 1))
+        return graph
+
+    def export_chrome_trace(self, path):
+        events = []
+        for frame_start, phases in self.frames:
+            for name, start, duration in phases:
+                events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': start * 1e6, 'dur': duration * 1e6})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def export_csv(self, path):
+        with open(path, 'w') as file:
+            file.write('frame,' + ','.join(self.phases) + ',total_ms\n')
+            n = 0
+            for frame_start, phases in self.frames:
+                durations = dict.fromkeys(self.phases, 0)
+                for name, start, duration in phases:
+                    durations[name] += duration
+                row = [str(n)] + ['%.4f' % (durations[name] * 1000) for name in self.phases]
+                file.write(','.join(row) + ',%.4f\n' % (sum(durations.values()) * 1000))
+                n += 1
+
+    def export(self, path):
+        if path.endswith('.csv'):
+            self.export_csv(path)
+        else:
+            self.export_chrome_trace(path)
+
+# -- Replays
+# Header (magic, version, seed, ticks) then the zlib-compressed input stream, one byte per tick:
+# bit 0 left held, bit 1 right held, bit 2 jump pressed, bits 3-7 shurikens thrown
+REPLAY_MAGIC = b'PWRP'
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct('<4sBQI')
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_SHOTS = 3
+INPUT_MAX_SHOTS = 31
+
+class Replay(object):
+    def __init__(self, seed, inputs = None):
+        self.seed = seed
+        self.inputs = bytearray(inputs or b'')
+
+    def record(self, mask):
+        self.inputs.append(mask)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, len(self.inputs)))
+            file.write(zlib.compress(bytes(self.inputs), 9))
+
+def load_replay(path):
+    with open(path, 'rb') as file:
+        magic, version, seed, ticks = REPLAY_HEADER.unpack(file.read(REPLAY_HEADER.size))
+        if magic != REPLAY_MAGIC or version > REPLAY_VERSION:
+            raise ValueError(path + ' is not a replay file')
+        inputs = zlib.decompress(file.read())
+    if len(inputs) != ticks:
+        raise ValueError(path + ' is truncated')
+    return Replay(seed, inputs)
+
+# -- Snapshots
+# Header (magic, version, ticks, timer wheel now, camera active, map width and height, navigator goal), RNG state, tiles,
+# camera, update ticks, then the player, coin, enemies and projectiles records in order
+SNAPSHOT_MAGIC = b'PWSS'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct('<4sBII?IIii')
+SNAPSHOT_RANDOM = struct.Struct('<625Id?')
+SNAPSHOT_CAMERA = struct.Struct('<iiii')
+SNAPSHOT_PLAYER = struct.Struct('<iiiiidi?Bi??')
+SNAPSHOT_COIN = struct.Struct('<iiii')
+SNAPSHOT_ENEMIES = struct.Struct('<IIIiii')
+SNAPSHOT_ENEMY = struct.Struct('<BBiiiiidii????bIiiiiii')
+SNAPSHOT_SHURIKEN = struct.Struct('<iiiii')
+SNAPSHOT_COUNT = struct.Struct('<I')
+
 # -- Main
-pygame.init()
-screen = pygame.display.set_mode(WINDOW_SIZE, 0, 32)
-display = pygame.Surface(DISPLAY_SIZE)
-pygame.display.set_caption("Frog Training")
+class Game(object):
+    def __init__(self, headless = False, loading_policy = LOADING_POLICY, seed = None, record = False,
+                 scale = SCALE, present_mode = PRESENT_MODE, chase = CHASE_PLAYER):
+        self.start_time = time.perf_counter()
+        self.timings = {}
+        self.headless = headless
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        start = time.perf_counter()
+        pygame.init()
+        self.scale = scale
+        self.window_size = (DISPLAY_SIZE[0] * scale, DISPLAY_SIZE[1] * scale)
+        self.present_mode = present_mode
+        match present_mode:
+            case 'scaled':
+                # SDL picks the integer window scale and stretches the display itself
+                self.screen = pygame.display.set_mode(DISPLAY_SIZE, pygame.SCALED, 32)
+                self.display = self.screen
+            case 'scale':
+                self.screen = pygame.display.set_mode(self.window_size, 0, 32)
+                self.display = pygame.Surface(DISPLAY_SIZE, 0, self.screen)
+            case _:
+                raise ValueError(str(present_mode) + ' is not a present mode')
+        pygame.display.set_caption("Frog Training")
+        sounds.reserve()
+        self.timings['pygame.init'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.loading_policy = loading_policy
+        if assets.atlas is None and os.path.exists(ATLAS_INDEX):
+            assets.load_atlas(ATLAS_INDEX)
+        match loading_policy:
+            case 'eager':
+                assets.preload(ASSETS_MANIFEST)
+            case 'lazy':
+                assets.queue(ASSETS_MANIFEST)
+            case 'thread':
+                assets.start_worker(ASSETS_MANIFEST)
+            case 'demand':
+                pass
+            case _:
+                raise ValueError(str(loading_policy) + ' is not a loading policy')
+        self.timings['loading phase'] = time.perf_counter() - start
+
+        self.clock = pygame.time.Clock()
+        self.running = True
+        self.render_enabled = True
+        self.ticks = 0
+        self.update_time = 0
+        self.render_time = 0
+        self.dirty_rects = DIRTY_RECTS
+        self.background = None
+        self.background_version = -1
+        self.background_pos = None
+        self.drawn_rects = []
+        self.dirty = []
+        self.pixels_pushed = 0
+        self.profiler = FrameProfiler()
+        self.scheduler = FixedStep()
+        self.intervals = dict(UPDATE_INTERVALS)
+        self.updated = {name: -1 for name in self.intervals}
+
+        # Everything random in the simulation comes from this seed, so inputs alone replay a session
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        random.seed(self.seed)
+        self.replay = Replay(self.seed) if record else None
+        self.jumps = 0
+        self.shots = 0
+        self.chase = chase
+        self.navigator = None
 
-clock = pygame.time.Clock()
+        timers.clear()
+        world_clock.now = 0
+        self.projectiles_manager = ProjectilesManager()
+        self.enemies_manager = EnemiesManager()
+        self.player = Player()
+        self.camera = Camera()
+        start = time.perf_counter()
+        game_map = Map()
+        self.timings['map'] = time.perf_counter() - start
+        self.coin = Coin(game_map)
+        self.coin.area = self.camera.rect
+        self.set_map(game_map)
 
-projectiles_manager = ProjectilesManager()
-enemies_manager = EnemiesManager()
-player = Player()
-game_map = Map()
-now = 0
-coin = Coin()
+    def set_map(self, game_map):
+        self.game_map = game_map
+        self.coin.game_map = game_map
+        self.enemies_manager.spawn_map = game_map
+        self.enemies_manager.spawn_point = (game_map.rect.centerx, -8)
+        if self.chase:
+            self.navigator = Navigator(game_map)
+            self.enemies_manager.navigator = self.navigator
+        self.camera.follow(self.player.rect, game_map.rect)
+        self.camera.last_pos = self.camera.rect.topleft
+        self.background = None
 
-while True:
-    display.fill((24, 28, 41))
+    def snapshot(self):
+        # The whole simulated world as one flat buffer; restore() puts it back
+        version, internal, gauss = random.getstate()
+        camera = self.camera
+        goal = (-1, -1)
+        if self.navigator is not None and self.navigator.goal is not None:
+            goal = self.navigator.goal
+        return b''.join([
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.ticks, timers.now,
+                self.enemies_manager.active is not None, self.game_map.width, self.game_map.height, *goal),
+            SNAPSHOT_RANDOM.pack(*internal, gauss or 0.0, gauss is not None),
+            bytes(self.game_map.data),
+            SNAPSHOT_CAMERA.pack(camera.rect.x, camera.rect.y, camera.last_pos[0], camera.last_pos[1]),
+            struct.pack('<%di' % len(self.updated), *self.updated.values()),
+            self.player.snapshot(),
+            self.coin.snapshot(),
+            self.enemies_manager.snapshot(),
+            self.projectiles_manager.snapshot()])
 
-    for event in pygame.event.get():
+    def restore(self, data):
+        magic, version, ticks, now, active, width, height, goal_x, goal_y = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('not a snapshot')
+        data = memoryview(data)
+        offset = SNAPSHOT_HEADER.size
+        state = SNAPSHOT_RANDOM.unpack_from(data, offset)
+        offset += SNAPSHOT_RANDOM.size
+        self.game_map.restore(width, height, data[offset:offset + width * height])
+        offset += width * height
+        self.enemies_manager.spawn_point = (self.game_map.rect.centerx, -8)
+        x, y, last_x, last_y = SNAPSHOT_CAMERA.unpack_from(data, offset)
+        offset += SNAPSHOT_CAMERA.size
+        self.camera.rect.topleft = (x, y)
+        self.camera.last_pos = (last_x, last_y)
+        updated = struct.unpack_from('<%di' % len(self.updated), data, offset)
+        offset += 4 * len(updated)
+        self.updated = dict(zip(self.updated, updated))
+
+        # Timers reschedule themselves as their entities are restored
+        timers.clear()
+        timers.now = now
+        self.ticks = ticks
+        world_clock.now = ticks
+        offset = self.player.restore(data, offset)
+        offset = self.coin.restore(data, offset)
+        offset = self.enemies_manager.restore(data, offset)
+        self.projectiles_manager.restore(data, offset)
+        self.enemies_manager.active = self.camera.active_rect() if active else None
+        if self.navigator is not None:
+            self.navigator.restore(None if goal_x < 0 else (goal_x, goal_y))
+        self.background = None
+        # Last, since respawning entities draws from the generator
+        random.setstate((random.Random.VERSION, state[:625], state[625] if state[626] else None))
+
+    def handle_event(self, event):
+        player = self.player
         if event.type == KEYDOWN:
             if event.key == K_a:
                 player.move_left = True
             if event.key == K_d:
                 player.move_right = True
             if event.key == K_k:
-                if player.airtime < 5:
-                    player.velocity[1] = -player.jspeed
-                    player.jump_sfx.play()
+                self.jumps += 1
             if event.key == K_j:
-                player.shoot(projectiles_manager.projectiles)
+                self.shots += 1
+            if event.key == K_p:
+                self.profiler.visible = not self.profiler.visible
         if event.type == KEYUP:
             if event.key == K_a:
                 player.move_left = False
             if event.key == K_d:
                 player.move_right = False
         if event.type == QUIT:
-            pygame.quit()
-            sys.exit()
-    # -- objs
-    game_map.render(display)
-    player.render(display)
-    projectiles_manager.render(display)
-    enemies_manager.render(display)
-    coin.render(display)
-    player.update(game_map.tile_rects, enemies_manager.enemies, coin)
-    projectiles_manager.update(game_map.tile_rects, enemies_manager.enemies)
-    now += 1
-    if now > 1:
-        now = 0
-        enemies_manager.update(game_map.tile_rects)
-    # -- objs
-    screen.blit(pygame.transform.scale(display, WINDOW_SIZE), (0, 0))
-    
-    pygame.display.update()
-    clock.tick(60)
+            self.running = False
+
+    def input_mask(self):
+        mask = 0
+        if self.player.move_left:
+            mask |= INPUT_LEFT
+        if self.player.move_right:
+            mask |= INPUT_RIGHT
+        if self.jumps:
+            mask |= INPUT_JUMP
+        return mask | (min(self.shots, INPUT_MAX_SHOTS) << INPUT_SHOTS)
+
+    def set_input(self, mask):
+        self.player.move_left = bool(mask & INPUT_LEFT)
+        self.player.move_right = bool(mask & INPUT_RIGHT)
+        self.jumps = 1 if mask & INPUT_JUMP else 0
+        self.shots = mask >> INPUT_SHOTS
+
+    def apply_input(self):
+        player = self.player
+        self.shots = min(self.shots, INPUT_MAX_SHOTS)
+        if self.replay is not None:
+            self.replay.record(self.input_mask())
+        if self.jumps:
+            if player.airtime < 5:
+                player.velocity[1] = -player.jspeed
+                sounds.play('jump')
+        for i in range(self.shots):
+            player.shoot(self.projectiles_manager)
+        self.jumps = 0
+        self.shots = 0
+
+    def blend(self, alpha):
+        # Per subsystem interpolation factor; one updated every N ticks is spread over those N ticks
+        blend = {}
+        for name, interval in self.intervals.items():
+            if alpha >= 1:
+                blend[name] = 1
+            else:
+                blend[name] = min(1, max(0, (self.ticks - 1 - self.updated[name] + alpha) / interval))
+        return blend
+
+    def render(self, alpha = 1):
+        if self.dirty_rects:
+            self.render_dirty(alpha)
+            return
+        start = time.perf_counter()
+        blend = self.blend(alpha)
+        view = self.camera.view(blend['player'])
+        self.display.fill(BACKGROUND_COLOR)
+        self.game_map.render(self.display, view.topleft)
+        start = self.profiler.mark('map render', start)
+        self.render_entities(start, blend, view)
+        if self.profiler.visible:
+            self.profiler.render(self.display)
+        self.pixels_pushed = self.window_size[0] * self.window_size[1]
+
+    def render_entities(self, start, blend, view):
+        profiler = self.profiler
+        # Culling tests the simulated rect, so the view is padded by the furthest an interpolated sprite can lag
+        cull = view.inflate(16, 16)
+        self.player.render(self.display, blend['player'], view.topleft)
+        start = profiler.mark('player render', start)
+        self.projectiles_manager.render(self.display, blend['projectiles'], view.topleft, cull)
+        start = profiler.mark('projectiles render', start)
+        self.enemies_manager.render(self.display, blend['enemies'], view.topleft, cull)
+        start = profiler.mark('enemies render', start)
+        self.coin.render(self.display, view.topleft)
+        profiler.mark('coin render', start)
+
+    def entity_rects(self, blend, view):
+        rects = [pygame.Rect(interpolate(self.player, blend['player']), self.player.rect.size), self.coin.rect.copy()]
+        for projectile in self.projectiles_manager.projectiles:
+            rects.append(pygame.Rect(interpolate(projectile, blend['projectiles']), projectile.rect.size))
+        for enemy in self.enemies_manager.enemies:
+            rects.append(pygame.Rect(interpolate(enemy, blend['enemies']), enemy.rect.size))
+        return [rect.move(-view.x, -view.y) for rect in rects if view.colliderect(rect)]
+
+    def render_dirty(self, alpha = 1):
+        # Erase last frame's sprites from the cached background, then redraw only them
+        start = time.perf_counter()
+        display_rect = self.display.get_rect()
+        blend = self.blend(alpha)
+        view = self.camera.view(blend['player'])
+        # A scrolling camera invalidates the whole background, like an edited map
+        if self.background is None or self.background_version != self.game_map.version or self.background_pos != view.topleft:
+            self.background = pygame.Surface(DISPLAY_SIZE)
+            self.background.fill(BACKGROUND_COLOR)
+            self.game_map.render(self.background, view.topleft)
+            self.background_version = self.game_map.version
+            self.background_pos = view.topleft
+            self.display.blit(self.background, (0, 0))
+            self.dirty = [display_rect]
+        else:
+            for rect in self.drawn_rects:
+                self.display.blit(self.background, rect, rect)
+            self.dirty = self.drawn_rects
+        start = self.profiler.mark('map render', start)
+        self.render_entities(start, blend, view)
+        self.drawn_rects = self.entity_rects(blend, view)
+        if self.profiler.visible:
+            self.drawn_rects.append(self.profiler.render(self.display))
+        self.dirty = [rect.clip(display_rect) for rect in self.dirty + self.drawn_rects]
+        self.dirty = [rect for rect in self.dirty if rect.w and rect.h]
+        self.pixels_pushed = sum([rect.w * rect.h for rect in self.dirty]) * self.scale * self.scale
+
+    def due(self, name):
+        interval = self.intervals[name]
+        if self.ticks % interval != interval - 1:
+            return False
+        self.updated[name] = self.ticks
+        return True
+
+    def update(self):
+        profiler = self.profiler
+        start = time.perf_counter()
+        if self.due('player'):
+            self.player.update(self.game_map, self.enemies_manager, self.coin)
+            self.camera.follow(self.player.rect, self.game_map.rect)
+            self.enemies_manager.active = self.camera.active_rect()
+            start = profiler.mark('player update', start)
+        if self.due('projectiles'):
+            self.projectiles_manager.update(self.game_map, self.enemies_manager)
+            start = profiler.mark('projectiles update', start)
+        if self.due('enemies'):
+            if self.navigator is not None:
+                self.navigator.set_goal(self.player.rect)
+            self.enemies_manager.update(self.game_map)
+            profiler.mark('enemies update', start)
+
+    def present(self):
+        start = time.perf_counter()
+        if self.present_mode == 'scaled':
+            if self.dirty_rects:
+                pygame.display.update(self.dirty)
+            else:
+                pygame.display.flip()
+            self.profiler.mark('present', start)
+            return
+        if not self.dirty_rects:
+            # Nearest-neighbour straight into the window surface, no per-frame allocation
+            pygame.transform.scale(self.display, self.window_size, self.screen)
+            pygame.display.update()
+            self.profiler.mark('present', start)
+            return
+        scale = self.scale
+        updates = []
+        for rect in self.dirty:
+            screen_rect = pygame.Rect(rect.x * scale, rect.y * scale, rect.w * scale, rect.h * scale)
+            pygame.transform.scale(self.display.subsurface(rect), screen_rect.size, self.screen.subsurface(screen_rect))
+            updates.append(screen_rect)
+        pygame.display.update(updates)
+        self.profiler.mark('present', start)
+
+    def read_input(self, events = None, mask = None):
+        if mask is not None:
+            self.set_input(mask)
+        else:
+            if events is None:
+                events = pygame.event.get()
+            for event in events:
+                self.handle_event(event)
+
+    def simulate(self):
+        start = time.perf_counter()
+        self.update()
+        self.update_time = time.perf_counter() - start
+        self.ticks += 1
+        world_clock.now = self.ticks
+
+    def end_frame(self):
+        if self.render_enabled and not self.headless:
+            self.present()
+        if assets.pending:
+            assets.preload_step()
+        sounds.end_frame()
+        self.profiler.end_frame()
+        if 'first frame' not in self.timings:
+            self.timings['first frame'] = time.perf_counter() - self.start_time
+
+    def tick(self, events = None, mask = None):
+        # One logic tick and one frame in lockstep, used by replays, benchmarks and batch runs
+        self.read_input(events, mask)
+        self.apply_input()
+        start = self.profiler.begin_frame()
+        if self.render_enabled:
+            self.render()
+        self.render_time = time.perf_counter() - start
+        self.simulate()
+        self.end_frame()
+
+    def frame(self):
+        # Real time frame: as many fixed ticks as are due, then a render interpolated between the last two
+        self.read_input()
+        start = self.profiler.begin_frame()
+        for i in range(self.scheduler.advance(time.perf_counter())):
+            self.apply_input()
+            self.simulate()
+        start = time.perf_counter()
+        if self.render_enabled:
+            self.render(self.scheduler.alpha())
+        self.render_time = time.perf_counter() - start
+        self.end_frame()
+
+    def startup_report(self):
+        report = 'loading policy: ' + self.loading_policy + '\n'
+        for name in ('pygame.init', 'loading phase', 'map', 'first frame'):
+            if name in self.timings:
+                report += '%-14s %8.2f ms\n' % (name, self.timings[name] * 1000)
+        report += '%-14s %8.2f ms (%d pending)' % ('asset decode', assets.decode_time * 1000, len(assets.pending))
+        return report
+
+    def step(self, ticks, script = None):
+        # script(game, tick) returns the events to feed in place of pygame.event.get
+        for i in range(ticks):
+            if not self.running:
+                break
+            self.tick(script(self, self.ticks) if script else [])
+
+    def run(self, replay_path = None, profile_path = None):
+        while self.running:
+            self.frame()
+            self.clock.tick(RENDER_FPS)
+        if replay_path is not None and self.replay is not None:
+            self.replay.save(replay_path)
+        if profile_path is not None:
+            self.profiler.export(profile_path)
+        pygame.quit()
+        sys.exit()
+
+def key_event(event_type, key):
+    return pygame.event.Event(event_type, key = key)
+
+def play_replay(replay, render = False):
+    # Re-simulates the session unthrottled; the same seed and inputs reproduce it tick for tick
+    game = Game(headless = True, seed = replay.seed)
+    game.render_enabled = render
+    for mask in replay.inputs:
+        game.tick(mask = mask)
+    return game
+
+def main():
+    # python game.py [--record session.rpl | --replay session.rpl] [--profile trace.json | trace.csv]
+    #                [--scale 2..8] [--present scale | scaled]
+    options = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    if '--replay' in options:
+        replay = load_replay(options['--replay'])
+        start = time.perf_counter()
+        game = play_replay(replay)
+        elapsed = time.perf_counter() - start
+        print('replayed %d ticks in %.3f s (%.0f ticks/s, %.1fx real time)' % (game.ticks, elapsed,
+            game.ticks / elapsed, game.ticks / 60 / elapsed))
+        if '--profile' in options:
+            game.profiler.export(options['--profile'])
+        return
+    game = Game(record = '--record' in options, scale = int(options.get('--scale', SCALE)),
+                present_mode = options.get('--present', PRESENT_MODE))
+    game.run(options.get('--record'), options.get('--profile'))
+
+if __name__ == '__main__':
+    main()
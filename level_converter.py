@@ -0,0 +1,13 @@
+import sys
+import game
+
+def convert(src, dst, rle = False):
+    width, height, data = game.read_text_level(src)
+    game.write_level(dst, width, height, data, rle)
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--rle']
+    if len(args) != 2:
+        print('usage: python level_converter.py level.dat level.lvl [--rle]')
+        sys.exit(1)
+    convert(args[0], args[1], '--rle' in sys.argv)
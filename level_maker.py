@@ -1,7 +1,9 @@
 import pygame, sys
 from pygame.locals import *
+import game
 
 WINDOW_SIZE = (256, 256)
+DIRTY_RECTS = False
 
 screen = pygame.display.set_mode(WINDOW_SIZE, 0, 32)
 pygame.display.set_caption("Levels Maker")
@@ -18,24 +20,41 @@ def draw_cell_rect(cell_x, cell_y):
     y = cell_y * 16
     rect = pygame.Rect(x, y, 16, 16)
     pygame.draw.rect(screen, (255, 0, 0), rect)
+    return rect
+
+def draw_cell(cell_x, cell_y):
+    rect = pygame.Rect(cell_x * 16, cell_y * 16, 16, 16)
+    pygame.draw.rect(screen, (0,0,0) if game_map[cell_y][cell_x] == 1 else (146,244,255), rect)
+    return rect
+
+full_redraw = True
+last_cell = None
+pixels_pushed = 0
 
 while True:
-    screen.fill((146,244,255))
-    
-    #Draw Tile map
-    y = 0
-    for row in game_map:
-        x = 0
-        for tile in row:
-            if tile == 1:
-                pygame.draw.rect(screen, (0,0,0),pygame.Rect(x*16,y*16,16,16))
-            x += 1
-        y += 1
+    dirty = []
+    if not DIRTY_RECTS or full_redraw:
+        screen.fill((146,244,255))
+
+        #Draw Tile map
+        y = 0
+        for row in game_map:
+            x = 0
+            for tile in row:
+                if tile == 1:
+                    pygame.draw.rect(screen, (0,0,0),pygame.Rect(x*16,y*16,16,16))
+                x += 1
+            y += 1
+        dirty.append(screen.get_rect())
+        full_redraw = False
     #Mouse
     mx,my = pygame.mouse.get_pos()
     cell_x = mx // 16
     cell_y = my // 16
-    draw_cell_rect(cell_x, cell_y)
+    if last_cell is not None and last_cell != (cell_x, cell_y):
+        dirty.append(draw_cell(*last_cell))
+    last_cell = (cell_x, cell_y)
+    dirty.append(draw_cell_rect(cell_x, cell_y))
     #----------------
     for event in pygame.event.get():
         if event.type == MOUSEBUTTONDOWN:
@@ -53,5 +72,13 @@ while True:
                         row_str = [str(element) for element in row]
                         row_txt = ''.join(row_str)
                         file.write(row_txt+'\n')
-    pygame.display.update()
+            if event.key == K_b:
+                game.write_level('level.lvl', w, h, bytearray([tile for row in game_map for tile in row]))
+    if DIRTY_RECTS:
+        # Only the cursor and the cell it left change between frames
+        pygame.display.update(dirty)
+        pixels_pushed = sum([rect.w * rect.h for rect in dirty])
+    else:
+        pygame.display.update()
+        pixels_pushed = WINDOW_SIZE[0] * WINDOW_SIZE[1]
     clock.tick(60)